@@ -0,0 +1,30 @@
+import os
+import sys
+
+sys.path.insert(
+    0,
+    os.path.join(os.path.dirname(__file__), "..", "..", "workflow", "scripts"))
+
+from integronfinder_analysis import (classify_integronfinder,
+                                     format_integronfinderout,
+                                     read_integronfinderout)
+
+
+def test_empty_output_directory(tmp_path):
+    assert read_integronfinderout(str(tmp_path)) == []
+
+
+def test_touched_summary_only(tmp_path):
+    raw = tmp_path / "Results_Integron_Finder_sample"
+    raw.mkdir()
+    (raw / "sample.summary").touch()
+    processed = tmp_path / "processed"
+    processed.mkdir()
+    regions = tmp_path / "regions.bed"
+    regions.write_text("contig_1\t0\t100\tgene\n")
+
+    integron_bed = format_integronfinderout(str(raw), str(processed))
+    output_bed = classify_integronfinder(str(regions), integron_bed,
+                                         str(processed), 0.95)
+    assert os.path.getsize(integron_bed) == 0
+    assert os.path.getsize(output_bed) == 0
@@ -0,0 +1,71 @@
+import os
+import random
+import sys
+
+sys.path.insert(
+    0,
+    os.path.join(os.path.dirname(__file__), "..", "..", "workflow", "scripts"))
+
+from intervals import ContigFeatures, Interval
+
+
+def brute_force(features, start, end):
+    return sorted((f for f in features if f.end > start and f.start < end),
+                  key=lambda f: (f.start, f.end))
+
+
+def make_features(n, seed, contig_length=100000):
+    rng = random.Random(seed)
+    features = []
+    for i in range(n):
+        start = rng.randrange(contig_length)
+        end = start + rng.randint(1, 500)
+        features.append(Interval("contig_1", start, end, [f"f{i}"]))
+    # one feature spanning the whole contig overlaps every query
+    features.append(Interval("contig_1", 0, contig_length, ["spanning"]))
+    rng.shuffle(features)
+    return features
+
+
+def as_tuples(features):
+    return [(f.start, f.end, f.name) for f in features]
+
+
+def test_overlapping_with_spanning_feature():
+    rng = random.Random(1)
+    for n in (0, 1, 2, 7, 16, 17, 100, 1000):
+        features = make_features(n, n)
+        index = ContigFeatures(features)
+        for _ in range(200):
+            start = rng.randrange(-100, 100100)
+            end = start + rng.randint(0, 2000)
+            hits = index.overlapping(start, end)
+            assert as_tuples(hits) == as_tuples(
+                brute_force(features, start, end))
+
+
+def test_overlapping_input_order():
+    features = make_features(300, 2)
+    index = ContigFeatures(features)
+    hits = index.overlapping(40000, 42000, input_order=True)
+    expected = [f for f in features if f.end > 40000 and f.start < 42000]
+    assert as_tuples(hits) == as_tuples(expected)
+
+
+def test_sweep_with_spanning_feature():
+    rng = random.Random(3)
+    features = make_features(1000, 3)
+    index = ContigFeatures(features)
+    regions = []
+    for _ in range(500):
+        start = rng.randrange(-100, 100100)
+        regions.append(
+            Interval("contig_1", start, start + rng.randint(0, 2000)))
+    regions.sort(key=lambda r: (r.start, r.end))
+    for region, hits in zip(regions, index.sweep(regions, input_order=True)):
+        assert as_tuples(hits) == as_tuples(
+            index.overlapping(region.start, region.end, input_order=True))
+        assert as_tuples(hits) == as_tuples([
+            f for f in features
+            if f.end > region.start and f.start < region.end
+        ])
@@ -0,0 +1,30 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(
+    0,
+    os.path.join(os.path.dirname(__file__), "..", "..", "workflow", "scripts"))
+
+from phigaro_analysis import format_phigaro_output, read_tsv
+
+
+def test_malformed_tsv_leaves_no_bed(tmp_path):
+    phigaro_tsv = tmp_path / "sample.phigaro.tsv"
+    phigaro_tsv.write_text("scaffold\tbegin\tend\tid\ttaxonomy\n"
+                           "contig_1\t100\t900\tprophage_1\tSiphoviridae\n"
+                           "contig_1\tabc\t2000\tprophage_2\tMyoviridae\n")
+    with pytest.raises(SystemExit):
+        format_phigaro_output(read_tsv(str(phigaro_tsv)), str(tmp_path))
+    assert sorted(os.listdir(tmp_path)) == ["sample.phigaro.tsv"]
+
+
+def test_tsv_formatted_to_bed(tmp_path):
+    phigaro_tsv = tmp_path / "sample.phigaro.tsv"
+    phigaro_tsv.write_text("scaffold\tbegin\tend\tid\ttaxonomy\n"
+                           "contig_1\t100\t900\tprophage_1\tSiphoviridae\n")
+    phigaro_bed = format_phigaro_output(read_tsv(str(phigaro_tsv)),
+                                        str(tmp_path))
+    with open(phigaro_bed) as f:
+        assert f.read() == "contig_1\t100\t900\tprophage_1\tSiphoviridae\n"
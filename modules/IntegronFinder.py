@@ -6,8 +6,28 @@ import subprocess
 import sys
 
 
-def run_integronfinder(input_fasta, output_path, threads):
+def integronfinder_command(input_fasta, output_path, threads):
+    """
+    Returns the Integron-Finder command line and its output directory.
+    """
     integronfinder_output = os.path.join(output_path, "integronfinder_out")
+    command = [
+        "integron_finder",
+        "--local-max",
+        "--cpu",
+        f"{threads}",
+        "--linear",
+        "--outdir",
+        f"{integronfinder_output}",
+        f"{input_fasta}",
+    ]
+    return command, integronfinder_output
+
+
+def run_integronfinder(input_fasta, output_path, threads):
+    command, integronfinder_output = integronfinder_command(
+        input_fasta, output_path, threads
+    )
     if not os.path.exists(integronfinder_output):
         os.makedirs(integronfinder_output)
         logger.info(
@@ -15,19 +35,7 @@ def run_integronfinder(input_fasta, output_path, threads):
         )
     input_fasta_basename = os.path.basename(input_fasta)
     input_fasta_basename = os.path.splitext(input_fasta_basename)[0]
-    output = subprocess.run(
-        [
-            "integron_finder",
-            "--local-max",
-            "--cpu",
-            f"{threads}",
-            "--linear",
-            "--outdir",
-            f"{integronfinder_output}",
-            f"{input_fasta}",
-        ],
-        capture_output=True,
-    )
+    output = subprocess.run(command, capture_output=True)
     if output.returncode != 0:
         logger.error("Error in IntegronFinder!")
         logger.error(output)
@@ -5,24 +5,32 @@ from loguru import logger
 from Bio import SeqIO
 
 
-def run_plasmidfinder(input_fasta, output_path):
+def plasmidfinder_command(input_fasta, output_path):
+    """
+    Returns the plasmidfinder command line and its output directory.
+    """
     plasmidfinder_output = os.path.join(output_path, "plasmidfinder_out")
+    command = [
+        "plasmidfinder.py",
+        "-i",
+        f"{input_fasta}",
+        "-o",
+        f"{plasmidfinder_output}",
+        "-x",
+    ]
+    return command, plasmidfinder_output
+
+
+def run_plasmidfinder(input_fasta, output_path):
+    command, plasmidfinder_output = plasmidfinder_command(
+        input_fasta, output_path
+    )
     if not os.path.exists(plasmidfinder_output):
         os.makedirs(plasmidfinder_output)
         logger.info(
             f"Created {plasmidfinder_output} for output of plasmidfinder"
         )
-    output = subprocess.run(
-        [
-            "plasmidfinder.py",
-            "-i",
-            f"{input_fasta}",
-            "-o",
-            f"{plasmidfinder_output}",
-            "-x",
-        ],
-        capture_output=True,
-    )
+    output = subprocess.run(command, capture_output=True)
     if output.returncode != 0:
         logger.error("Error in plasmidfinder!")
         logger.error(output.stdout.decode())
@@ -5,24 +5,30 @@ from loguru import logger
 from Bio import SeqIO
 
 
-def run_mobrecon(ifasta):
+def mobrecon_command(ifasta, output_path, threads):
+    """
+    Returns the mob_recon command line and its output directory.
+    """
     mobrecon_output = os.path.join(output_path, "mobrecon_out")
+    command = [
+        "mob_recon",
+        "--infile",
+        f"{ifasta}",
+        "--num_threads",
+        f"{threads}",
+        "--outdir",
+        f"{mobrecon_output}",
+        "--force",
+    ]
+    return command, mobrecon_output
+
+
+def run_mobrecon(ifasta, output_path, threads):
+    command, mobrecon_output = mobrecon_command(ifasta, output_path, threads)
     if not os.path.exists(mobrecon_output):
         os.makedirs(mobrecon_output)
         logger.info(f"Created {mobrecon_output} for output of mob_recon")
-    output = subprocess.run(
-        [
-            "mob_recon",
-            "--infile",
-            f"{ifasta}",
-            "--num_threads",
-            f"{threads}",
-            "--outdir",
-            f"{mobrecon_output}",
-            "--force",
-        ],
-        capture_output=True,
-    )
+    output = subprocess.run(command, capture_output=True)
     if output.returncode != 0:
         logger.error("Error in mob_recon!")
         logger.error(output)
@@ -4,28 +4,38 @@ from loguru import logger
 import sys
 
 
+def mobileelementfinder_command(input_fasta, output_path, threads):
+    """
+    Returns the mobileElementFinder command line and its output directory.
+    Results are written next to it with the `out` prefix.
+    """
+    mefinder_dir = os.path.join(output_path, "mobileElementFinder_out")
+    mefinder_output = os.path.join(mefinder_dir, "out")
+    command = [
+        "mefinder",
+        "find",
+        "--contig",
+        f"{input_fasta}",
+        "--threads",
+        f"{threads}",
+        "--temp-dir",
+        f"{mefinder_output}/tmp",
+        f"{mefinder_output}",
+    ]
+    return command, mefinder_dir
+
+
 def run_mobileelementfinder(input_fasta, output_path, threads):
-    mefinder_output = os.path.join(output_path, "mobileElementFinder_out")
+    command, mefinder_output = mobileelementfinder_command(
+        input_fasta, output_path, threads
+    )
     if not os.path.exists(mefinder_output):
         os.makedirs(mefinder_output)
         logger.info(
             f"Created {mefinder_output} for output of mobileElementFinder"
         )
     mefinder_output = os.path.join(mefinder_output, "out")
-    output = subprocess.run(
-        [
-            "mefinder",
-            "find",
-            "--contig",
-            f"{input_fasta}",
-            "--threads",
-            f"{threads}",
-            "--temp-dir",
-            f"{mefinder_output}/tmp",
-            f"{mefinder_output}",
-        ],
-        capture_output=True,
-    )
+    output = subprocess.run(command, capture_output=True)
     if output.returncode != 0:
         logger.error("Error in mobileelementfinder!")
         logger.error(output.stdout.decode())
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+
+import argparse
+import asyncio
+import collections
+import contextlib
+import os
+import sys
+from loguru import logger
+
+from IntegronFinder import integronfinder_command
+from PlasmidFinder import plasmidfinder_command
+from mob_suite import mobrecon_command
+from mobileelementfinder import mobileelementfinder_command
+
+
+class CoreBudget:
+    """
+    A semaphore counting CPU cores. Each tool reserves the cores it runs
+    on, and reservations are granted first come, first served so that
+    multi-threaded tools are not starved by single-threaded ones.
+    """
+
+    def __init__(self, cores):
+        self.cores = cores
+        self.free = cores
+        self._waiting = collections.deque()
+        self._condition = asyncio.Condition()
+
+    @contextlib.asynccontextmanager
+    async def reserve(self, cores):
+        cores = min(cores, self.cores)
+        ticket = object()
+        async with self._condition:
+            self._waiting.append(ticket)
+            await self._condition.wait_for(
+                lambda: self._waiting[0] is ticket and self.free >= cores
+            )
+            self._waiting.popleft()
+            self.free -= cores
+            # the next reservation in line may fit in what is left
+            self._condition.notify_all()
+        try:
+            yield cores
+        finally:
+            async with self._condition:
+                self.free += cores
+                self._condition.notify_all()
+
+
+# tools without an option for the number of threads
+SINGLE_THREADED = {"plasmidfinder"}
+
+
+def tool_commands(input_fasta, output_path, threads):
+    """
+    Returns the command line and output directory of every tool for one
+    assembly.
+    """
+    return {
+        "integronfinder": integronfinder_command(
+            input_fasta, output_path, threads
+        ),
+        "plasmidfinder": plasmidfinder_command(input_fasta, output_path),
+        "mob_recon": mobrecon_command(input_fasta, output_path, threads),
+        "mobileelementfinder": mobileelementfinder_command(
+            input_fasta, output_path, threads
+        ),
+    }
+
+
+async def run_tool(name, command, tool_output, cores, log_dir, budget):
+    """
+    Runs one tool once its cores are free, streaming its stdout and stderr
+    to log files. Returns the tool's exit status.
+    """
+    os.makedirs(tool_output, exist_ok=True)
+    stdout_log = os.path.join(log_dir, f"{name}.stdout.log")
+    stderr_log = os.path.join(log_dir, f"{name}.stderr.log")
+    async with budget.reserve(cores):
+        logger.info(f"Starting {name}: {' '.join(command)}")
+        with open(stdout_log, "wb") as stdout, open(
+            stderr_log, "wb"
+        ) as stderr:
+            try:
+                process = await asyncio.create_subprocess_exec(
+                    *command, stdout=stdout, stderr=stderr
+                )
+            except OSError as e:
+                logger.error(f"Could not start {name}: {e}")
+                return 127
+            try:
+                returncode = await process.wait()
+            except asyncio.CancelledError:
+                process.terminate()
+                await process.wait()
+                raise
+    if returncode != 0:
+        logger.error(f"Error in {name}! See {stderr_log}")
+    else:
+        logger.success(f"Completed {name}")
+    return returncode
+
+
+async def run_assembly(input_fasta, output_dir, threads, budget):
+    """
+    Starts every tool for one assembly at once and returns their exit
+    statuses.
+    """
+    sample = os.path.splitext(os.path.basename(input_fasta))[0]
+    output_path = os.path.join(output_dir, sample)
+    log_dir = os.path.join(output_path, "logs")
+    os.makedirs(log_dir, exist_ok=True)
+    commands = tool_commands(input_fasta, output_path, threads)
+    returncodes = await asyncio.gather(
+        *(
+            run_tool(
+                name,
+                command,
+                tool_output,
+                1 if name in SINGLE_THREADED else threads,
+                log_dir,
+                budget,
+            )
+            for name, (command, tool_output) in commands.items()
+        )
+    )
+    return input_fasta, dict(zip(commands, returncodes))
+
+
+async def run_assemblies(assemblies, output_dir, threads, cores):
+    budget = CoreBudget(cores)
+    tasks = [
+        asyncio.ensure_future(
+            run_assembly(input_fasta, output_dir, threads, budget)
+        )
+        for input_fasta in assemblies
+    ]
+    failed = []
+    # report each assembly as soon as all of its tools have finished
+    for finished in asyncio.as_completed(tasks):
+        input_fasta, returncodes = await finished
+        errors = [name for name, code in returncodes.items() if code != 0]
+        if errors:
+            logger.error(f"{input_fasta}: {', '.join(errors)} failed")
+            failed.append(input_fasta)
+        else:
+            logger.success(f"{input_fasta}: all tools completed")
+    return failed
+
+
+def read_assemblies(input_list):
+    with open(input_list, "r") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run every tool on a list of assemblies at once, sharing "
+        "a budget of CPU cores."
+    )
+    parser.add_argument(
+        "--input",
+        "-i",
+        help="[REQUIRED] Path to a list of assemblies, one per line",
+        type=os.path.abspath,
+        required=True,
+    )
+    parser.add_argument(
+        "--output",
+        "-o",
+        help="Directory for the output. Default is ./maybemobile_out/",
+        type=os.path.abspath,
+        default="./maybemobile_out/",
+        required=False,
+    )
+    parser.add_argument(
+        "--cores",
+        "-c",
+        help="Number of cores shared by all running tools. Default is all "
+        "available.",
+        type=int,
+        default=len(os.sched_getaffinity(0)),
+        required=False,
+    )
+    parser.add_argument(
+        "--threads",
+        "-t",
+        help="Number of threads given to each multi-threaded tool. "
+        "Default is 4.",
+        type=int,
+        default=4,
+        required=False,
+    )
+    args = parser.parse_args()
+
+    assemblies = read_assemblies(args.input)
+    logger.info(
+        f"Running tools on {len(assemblies)} assemblies with {args.cores} "
+        "cores"
+    )
+    failed = asyncio.run(
+        run_assemblies(assemblies, args.output, args.threads, args.cores)
+    )
+    if failed:
+        logger.error(f"Tools failed for {len(failed)} assemblies")
+        sys.exit(1)
+    logger.success(f"Completed all tools for {len(assemblies)} assemblies")
+
+
+if __name__ == "__main__":
+    main()
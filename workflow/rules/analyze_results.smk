@@ -1,16 +1,23 @@
 intermediate_dir = config["intermediate_dir"]
 output_dir = config["output_dir"]
 
+# reformat_bed, the *_bed rules and the aggregation of each sample form one
+# connected "postprocess" group; on a cluster, --group-components
+# postprocess=N submits the groups of N samples as a single job
+
 
 rule plasmidfinder_bed:
     output:
         f"{intermediate_dir}/{{batch}}/PlasmidFinder/processed/sequence_{{seqnum}}/{{sample}}/plasmidfinder_out.sorted.bed",
     input:
-        fa=lambda wildcards: get_sample_path(wildcards.batch, wildcards.seqnum),
+        index=lambda wildcards: fn_fastaindex(wildcards.batch, wildcards.seqnum),
         bed=lambda wildcards: fn_cleanbed(wildcards.batch, wildcards.seqnum),
         plasmidfinderout=f"{intermediate_dir}/{{batch}}/PlasmidFinder/raw/sequence_{{seqnum}}/{{sample}}/data.json",
     params:
         script=Path(workflow.basedir) / "scripts/plasmidfinder_analysis.py",
+        bed_format=bed_format_args(),
+    group:
+        "postprocess"
     conda:
         "../envs/callmemobile.yml"
     shell:
@@ -18,7 +25,8 @@ rule plasmidfinder_bed:
         {params.script} \\
                 -i {input.plasmidfinderout} \\
                 -b {input.bed} \\
-                -f {input.fa} \\
+                -x {input.index} \\
+                {params.bed_format} \\
                 -o {output}
         """
 
@@ -27,11 +35,14 @@ rule mobsuite_bed:
     output:
         f"{intermediate_dir}/{{batch}}/mob-suite/processed/sequence_{{seqnum}}/{{sample}}/mobrecon_out/input-mobrecon_out-intersect.sorted.bed",
     input:
-        fa=lambda wildcards: get_sample_path(wildcards.batch, wildcards.seqnum),
+        index=lambda wildcards: fn_fastaindex(wildcards.batch, wildcards.seqnum),
         bed=lambda wildcards: fn_cleanbed(wildcards.batch, wildcards.seqnum),
         mobout=f"{intermediate_dir}/{{batch}}/mob-suite/raw/sequence_{{seqnum}}/{{sample}}/contig_report.txt",
     params:
         script=Path(workflow.basedir) / "scripts/mobsuite_analysis.py",
+        bed_format=bed_format_args(),
+    group:
+        "postprocess"
     conda:
         "../envs/callmemobile.yml"
     shell:
@@ -39,7 +50,8 @@ rule mobsuite_bed:
         {params.script} \\
                 -i $(dirname {input.mobout}) \\
                 -b {input.bed} \\
-                -f {input.fa} \\
+                -x {input.index} \\
+                {params.bed_format} \\
                 -o $(dirname {output})
         """
 
@@ -48,12 +60,14 @@ rule integronfinder_bed:
     output:
         f"{intermediate_dir}/{{batch}}/IntegronFinder/processed/sequence_{{seqnum}}/{{sample}}/input-ifinder_out-intersect.sorted.bed",
     input:
-        fa=lambda wildcards: get_sample_path(wildcards.batch, wildcards.seqnum),
         bed=lambda wildcards: fn_cleanbed(wildcards.batch, wildcards.seqnum),
         ifinderout=f"{intermediate_dir}/{{batch}}/IntegronFinder/raw/sequence_{{seqnum}}/Results_Integron_Finder_{{sample}}/{{sample}}.summary",
     params:
         script=Path(workflow.basedir) / "scripts/integronfinder_analysis.py",
         overlap=config["integron_pctolap"],
+        bed_format=bed_format_args(),
+    group:
+        "postprocess"
     conda:
         "../envs/callmemobile.yml"
     shell:
@@ -62,6 +76,7 @@ rule integronfinder_bed:
                 -i $(dirname {input.ifinderout}) \\
                 -b {input.bed} \\
                 -bo {params.overlap} \\
+                {params.bed_format} \\
                 -o $(dirname {output})
         """
 
@@ -70,12 +85,15 @@ rule mobileelementfinder_bed:
     output:
         f"{intermediate_dir}/{{batch}}/mobileelementfinder/processed/sequence_{{seqnum}}/{{sample}}/input-mge_out-intersect.sorted.bed",
     input:
-        fa=lambda wildcards: get_sample_path(wildcards.batch, wildcards.seqnum),
+        index=lambda wildcards: fn_fastaindex(wildcards.batch, wildcards.seqnum),
         bed=lambda wildcards: fn_cleanbed(wildcards.batch, wildcards.seqnum),
         mefinderout=f"{intermediate_dir}/{{batch}}/mobileelementfinder/raw/sequence_{{seqnum}}/{{sample}}/mge_results.csv",
     params:
         script=Path(workflow.basedir) / "scripts/mobileelementfinder_analysis.py",
         maxdist=config["mobileelement_maxdist"],
+        bed_format=bed_format_args(),
+    group:
+        "postprocess"
     conda:
         "../envs/callmemobile.yml"
     shell:
@@ -83,8 +101,9 @@ rule mobileelementfinder_bed:
         {params.script} \\
                 -i {input.mefinderout} \\
                 -b {input.bed} \\
-                -f {input.fa} \\
+                -x {input.index} \\
                 -m {params.maxdist} \\
+                {params.bed_format} \\
                 -o $(dirname {output})
         """
 
@@ -98,6 +117,9 @@ rule phigaro_bed:
     params:
         script=Path(workflow.basedir) / "scripts/phigaro_analysis.py",
         maxdist=config["prophage_maxdist"],
+        bed_format=bed_format_args(),
+    group:
+        "postprocess"
     conda:
         "../envs/callmemobile.yml"
     shell:
@@ -107,6 +129,7 @@ rule phigaro_bed:
                     -i {input.phigaro} \\
                     -b {input.bed} \\
                     -o $(dirname {output}) \\
+                    {params.bed_format} \\
                     -m {params.maxdist}
         else
             touch {output}
@@ -114,42 +137,179 @@ rule phigaro_bed:
         """
 
 
-rule aggregate_output:
+rule annotation_index:
     output:
-        f"{output_dir}/{{batch}}/sequence_{{seqnum}}-{{sample}}-callmemobile.tsv",
+        f"{intermediate_dir}/{{batch}}/annotation_index/sequence_{{seqnum}}/{{sample}}.json",
     input:
-        bed=lambda wildcards: fn_cleanbed(wildcards.batch, wildcards.seqnum),
-        phigaro=lambda wildcards: fn_phigaroprocessed(
-            wildcards.batch, wildcards.seqnum, wildcards.sample
-        ),
-        mobrecon=lambda wildcards: fn_mobprocessed(
-            wildcards.batch, wildcards.seqnum, wildcards.sample
-        ),
-        plasmidfinder=lambda wildcards: fn_plasmidfinderprocessed(
-            wildcards.batch, wildcards.seqnum, wildcards.sample
-        ),
-        mefinder=lambda wildcards: fn_mefinderprocessed(
-            wildcards.batch, wildcards.seqnum, wildcards.sample
-        ),
-        integronfinder=lambda wildcards: fn_integronfinderprocessed(
-            wildcards.batch, wildcards.seqnum, wildcards.sample
-        ),
+        index=lambda wildcards: fn_fastaindex(wildcards.batch, wildcards.seqnum),
+        ifinderout=f"{intermediate_dir}/{{batch}}/IntegronFinder/raw/sequence_{{seqnum}}/Results_Integron_Finder_{{sample}}/{{sample}}.summary",
+        plasmidfinderout=f"{intermediate_dir}/{{batch}}/PlasmidFinder/raw/sequence_{{seqnum}}/{{sample}}/data.json",
+        mobout=f"{intermediate_dir}/{{batch}}/mob-suite/raw/sequence_{{seqnum}}/{{sample}}/contig_report.txt",
+        phigaro=f"{intermediate_dir}/{{batch}}/phigaro/raw/sequence_{{seqnum}}/{{sample}}.phigaro.tsv",
+        mefinderout=f"{intermediate_dir}/{{batch}}/mobileelementfinder/raw/sequence_{{seqnum}}/{{sample}}/mge_results.csv",
     params:
-        script=Path(workflow.basedir) / "scripts/callmemobile.py",
+        script=Path(workflow.basedir) / "scripts/annotation_index.py",
+    group:
+        "postprocess"
     conda:
         "../envs/callmemobile.yml"
     shell:
         """
-        if [ -s {input.bed} ]; then
-            {params.script} \\
-                    --integronfinder {input.integronfinder} \\
-                    --plasmidfinder {input.plasmidfinder} \\
-                    --mob_suite {input.mobrecon} \\
-                    --phigaro {input.phigaro} \\
-                    --mobileelementfinder {input.mefinder} \\
-                    --bed {input.bed} \\
-                    -o {output} 
-        else
-            touch {output}
-        fi
+        {params.script} build \\
+                -x {input.index} \\
+                --integronfinder $(dirname {input.ifinderout}) \\
+                --plasmidfinder {input.plasmidfinderout} \\
+                --mob_suite $(dirname {input.mobout}) \\
+                --phigaro {input.phigaro} \\
+                --mobileelementfinder {input.mefinderout} \\
+                -o {output}
         """
+
+
+rule aggregate_manifest:
+    output:
+        f"{intermediate_dir}/{{batch}}/callmemobile_manifest.tsv",
+    input:
+        txt=f"{dir_input()}/{{batch}}.txt",
+        beds=f"{dir_input()}/{{batch}}.beds",
+    localrule: True
+    run:
+        rows = fn_batch_aggregate_rows(wildcards.batch)
+        columns = list(rows[0].keys()) if rows else ["bed", "output"]
+        with open(output[0], "w") as f:
+            f.write("\t".join(columns) + "\n")
+            for row in rows:
+                f.write("\t".join(row[c] for c in columns) + "\n")
+
+
+if config.get("postprocess_per_sample", False):
+    # one job per sample classifying the cleaned bed against every tool and
+    # aggregating the classifications in a single process; reformat_bed
+    # cleans the bed once per sequence
+
+    rule postprocess_sample:
+        output:
+            integronfinder=f"{intermediate_dir}/{{batch}}/IntegronFinder/processed/sequence_{{seqnum}}/{{sample}}/input-ifinder_out-intersect.sorted.bed",
+            plasmidfinder=f"{intermediate_dir}/{{batch}}/PlasmidFinder/processed/sequence_{{seqnum}}/{{sample}}/plasmidfinder_out.sorted.bed",
+            mobrecon=f"{intermediate_dir}/{{batch}}/mob-suite/processed/sequence_{{seqnum}}/{{sample}}/mobrecon_out/input-mobrecon_out-intersect.sorted.bed",
+            phigaro=f"{intermediate_dir}/{{batch}}/phigaro/processed/sequence_{{seqnum}}/{{sample}}/input-phigaro_out-intersect.sorted.bed",
+            mefinder=f"{intermediate_dir}/{{batch}}/mobileelementfinder/processed/sequence_{{seqnum}}/{{sample}}/input-mge_out-intersect.sorted.bed",
+            table=f"{output_dir}/{{batch}}/sequence_{{seqnum}}-{{sample}}-callmemobile.tsv",
+        input:
+            index=lambda wildcards: fn_fastaindex(wildcards.batch, wildcards.seqnum),
+            bed=lambda wildcards: fn_cleanbed(wildcards.batch, wildcards.seqnum),
+            ifinderout=f"{intermediate_dir}/{{batch}}/IntegronFinder/raw/sequence_{{seqnum}}/Results_Integron_Finder_{{sample}}/{{sample}}.summary",
+            plasmidfinderout=f"{intermediate_dir}/{{batch}}/PlasmidFinder/raw/sequence_{{seqnum}}/{{sample}}/data.json",
+            mobout=f"{intermediate_dir}/{{batch}}/mob-suite/raw/sequence_{{seqnum}}/{{sample}}/contig_report.txt",
+            phigaro=f"{intermediate_dir}/{{batch}}/phigaro/raw/sequence_{{seqnum}}/{{sample}}.phigaro.tsv",
+            mefinderout=f"{intermediate_dir}/{{batch}}/mobileelementfinder/raw/sequence_{{seqnum}}/{{sample}}/mge_results.csv",
+        params:
+            script=Path(workflow.basedir) / "scripts/postprocess_sample.py",
+            overlap=config["integron_pctolap"],
+            prophage_maxdist=config["prophage_maxdist"],
+            mobileelement_maxdist=config["mobileelement_maxdist"],
+            bed_format=bed_format_args(),
+        group:
+            "postprocess"
+        conda:
+            "../envs/callmemobile.yml"
+        shell:
+            """
+            {params.script} \\
+                    -x {input.index} \\
+                    --cleaned {input.bed} \\
+                    --integronfinder $(dirname {input.ifinderout}) $(dirname {output.integronfinder}) \\
+                    --plasmidfinder {input.plasmidfinderout} $(dirname {output.plasmidfinder}) \\
+                    --mob_suite $(dirname {input.mobout}) $(dirname {output.mobrecon}) \\
+                    --phigaro {input.phigaro} $(dirname {output.phigaro}) \\
+                    --mobileelementfinder {input.mefinderout} $(dirname {output.mefinder}) \\
+                    -bo {params.overlap} \\
+                    --prophage_maxdist {params.prophage_maxdist} \\
+                    --mobileelement_maxdist {params.mobileelement_maxdist} \\
+                    {params.bed_format} \\
+                    -o {output.table}
+            """
+
+    ruleorder: postprocess_sample > integronfinder_bed
+    ruleorder: postprocess_sample > plasmidfinder_bed
+    ruleorder: postprocess_sample > mobsuite_bed
+    ruleorder: postprocess_sample > phigaro_bed
+    ruleorder: postprocess_sample > mobileelementfinder_bed
+
+elif config.get("aggregate_per_batch", False):
+    # one aggregation job per batch writing every per-sample table
+    for _batch in get_batches():
+        _rows = fn_batch_aggregate_rows(_batch)
+
+        rule:
+            name:
+                f"aggregate_batch_{_batch}"
+            output:
+                [row["output"] for row in _rows],
+            input:
+                manifest=fn_aggregate_manifest(_batch),
+                beds=[
+                    row[column]
+                    for row in _rows
+                    for column in row
+                    if column != "output"
+                ],
+            params:
+                script=Path(workflow.basedir) / "scripts/callmemobile_batch.py",
+            threads: config["threads"]
+            # not in the "postprocess" group, which would link every sample of
+            # the batch into a single cluster job
+            conda:
+                "../envs/callmemobile.yml"
+            shell:
+                """
+                {params.script} \\
+                        --manifest {input.manifest} \\
+                        --threads {threads} \\
+                        --stream
+                """
+
+else:
+
+    rule aggregate_output:
+        output:
+            f"{output_dir}/{{batch}}/sequence_{{seqnum}}-{{sample}}-callmemobile.tsv",
+        input:
+            bed=lambda wildcards: fn_cleanbed(wildcards.batch, wildcards.seqnum),
+            phigaro=lambda wildcards: fn_phigaroprocessed(
+                wildcards.batch, wildcards.seqnum, wildcards.sample
+            ),
+            mobrecon=lambda wildcards: fn_mobprocessed(
+                wildcards.batch, wildcards.seqnum, wildcards.sample
+            ),
+            plasmidfinder=lambda wildcards: fn_plasmidfinderprocessed(
+                wildcards.batch, wildcards.seqnum, wildcards.sample
+            ),
+            mefinder=lambda wildcards: fn_mefinderprocessed(
+                wildcards.batch, wildcards.seqnum, wildcards.sample
+            ),
+            integronfinder=lambda wildcards: fn_integronfinderprocessed(
+                wildcards.batch, wildcards.seqnum, wildcards.sample
+            ),
+        params:
+            script=Path(workflow.basedir) / "scripts/callmemobile.py",
+        group:
+            "postprocess"
+        conda:
+            "../envs/callmemobile.yml"
+        shell:
+            """
+            if [ -s {input.bed} ]; then
+                {params.script} \\
+                        --integronfinder {input.integronfinder} \\
+                        --plasmidfinder {input.plasmidfinder} \\
+                        --mob_suite {input.mobrecon} \\
+                        --phigaro {input.phigaro} \\
+                        --mobileelementfinder {input.mefinder} \\
+                        --bed {input.bed} \\
+                        --stream \\
+                        -o {output}
+            else
+                touch {output}
+            fi
+            """
@@ -1,8 +1,20 @@
 # In init.smk
 
+import hashlib
+import json
+import math
 import os
+import shlex
+import sys
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+from snakemake.exceptions import WorkflowError
+
+sys.path.insert(0, str(Path(workflow.basedir) / "scripts"))
+from batch_lists import get_sample_name, is_compressed, read_batch_lists
+
 
 configfile: "config.yaml"
 
@@ -19,63 +31,309 @@ def dir_output():
     return Path(config["output_dir"])
 
 
-beds = {}
-inputs = {}  # batch -> list of sample IDs
+# one row per line of a batch's {batch}.txt and {batch}.beds
+Sample = namedtuple("Sample", ["seqnum", "path", "bed", "name"])
+
+# number of parallel stat calls when checking that the inputs exist
+STAT_THREADS = 32
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def parse_batch(batch, txt, bed_list):
+    try:
+        paths = read_batch_lists(batch, txt, bed_list)
+    except ValueError as e:
+        raise WorkflowError(str(e))
+    return [
+        Sample(seqnum, sample_path, bed_path, get_sample_name(sample_path))
+        for seqnum, (sample_path, bed_path) in enumerate(paths, start=1)
+    ]
+
+
+def load_batch(batch, txt, bed_list):
+    # the sample table of a batch is cached until its lists change: an
+    # unchanged modification time skips reading them, and an unchanged hash
+    # skips parsing them again
+    cache = dir_intermediate() / "manifest_cache" / f"{batch}.json"
+    mtimes = [os.stat(txt).st_mtime_ns, os.stat(bed_list).st_mtime_ns]
+    cached = None
+    if cache.exists():
+        try:
+            with open(cache, "r") as f:
+                cached = json.load(f)
+        except ValueError:
+            cached = None
+    if cached is not None and cached["mtimes"] == mtimes:
+        return [Sample(*row) for row in cached["samples"]]
+    digests = [file_digest(txt), file_digest(bed_list)]
+    if cached is not None and cached["digests"] == digests:
+        samples = [Sample(*row) for row in cached["samples"]]
+    else:
+        samples = parse_batch(batch, txt, bed_list)
+    cache.parent.mkdir(parents=True, exist_ok=True)
+    tmp = cache.with_suffix(".json.tmp")
+    with open(tmp, "w") as f:
+        json.dump({"mtimes": mtimes, "digests": digests, "samples": samples}, f)
+    os.replace(tmp, cache)
+    return samples
+
+
+def get_selected_batches():
+    # `batches` limits the workflow to some batches, e.g.
+    # --config batches=[batch1,batch2]
+    selected = config.get("batches") or []
+    if isinstance(selected, str):
+        selected = selected.split(",")
+    return set(selected)
+
+
+def load_manifests():
+    selected = get_selected_batches()
+    manifests = {}
+    for txt in sorted(dir_input().glob("*.txt")):
+        batch = txt.name[: -len(".txt")]
+        if selected and batch not in selected:
+            continue
+        bed_list = dir_input() / f"{batch}.beds"
+        if not bed_list.exists():
+            raise WorkflowError(f"No list of bed files {bed_list} for batch {batch}")
+        manifests[batch] = load_batch(batch, txt, bed_list)
+    unknown = selected - manifests.keys()
+    if unknown:
+        raise WorkflowError(f"Unknown batches: {', '.join(sorted(unknown))}")
+    return manifests
+
+
+def stat_size(path):
+    try:
+        return os.stat(path).st_size
+    except OSError:
+        return None
+
+
+def stat_inputs(manifests):
+    # stat every assembly and bed file of the selected batches at once rather
+    # than one at a time; this also warms the file system's cache for
+    # Snakemake's own checks. Missing files have no size and are only reported
+    # by the jobs that need them
+    paths = sorted(
+        {
+            path
+            for samples in manifests.values()
+            for sample in samples
+            for path in (sample.path, sample.bed)
+        }
+    )
+    with ThreadPoolExecutor(max_workers=STAT_THREADS) as executor:
+        return dict(zip(paths, executor.map(stat_size, paths)))
+
+
+manifests = load_manifests()  # batch -> list of samples
+input_sizes = stat_inputs(manifests)  # input file -> size in bytes
 sample_seqnums = {}  # (batch, sample ID) -> sequence number
-
-batch_txts = dir_input().glob("*.txt")
-for x in batch_txts:
-    b = os.path.basename(x)[
-        :-4
-    ]  # Remove '.txt' from the filename to get the batch name
-    inputs[b] = []
-    with open(x, "r") as f:
-        seqnum = 1
-        for line in f:
-            sample_path = line.strip()
-            inputs[b].append(sample_path)
-            sample_seqnums[(b, sample_path)] = seqnum
-            seqnum += 1
-
-bed_txts = dir_input().glob("*.beds")
-for x in bed_txts:
-    b = os.path.basename(x)[
-        :-5
-    ]  # Remove '.beds' from the filename to get the batch name
-    beds[b] = []
-    with open(x, "r") as f:
-        seqnum = 1
-        for line in f:
-            bed_path = line.strip()
-            beds[b].append(bed_path)
-            sample_seqnums[(b, bed_path)] = seqnum
-            seqnum += 1
+for b, samples in manifests.items():
+    for sample in samples:
+        sample_seqnums[(b, sample.path)] = sample.seqnum
+        sample_seqnums[(b, sample.bed)] = sample.seqnum
 
 
 def get_batches():
-    return inputs.keys()
+    return manifests.keys()
 
 
 def get_samples(_batch):
-    return inputs[_batch]
+    return [sample.path for sample in manifests[_batch]]
 
 
 def get_beds(_batch):
-    return beds[_batch]
+    return [sample.bed for sample in manifests[_batch]]
+
+
+def check_input(batch, sample, path):
+    if path in input_sizes and input_sizes[path] is None:
+        raise WorkflowError(
+            f"Input {path} of sample {sample.name} (sequence_{sample.seqnum}) "
+            f"in batch {batch} does not exist"
+        )
+    return path
 
 
 def get_sample_path(batch, seqnum):
-    return inputs[batch][int(seqnum) - 1]
+    sample = manifests[batch][int(seqnum) - 1]
+    return check_input(batch, sample, sample.path)
 
 
 def get_bed_path(batch, seqnum):
-    return beds[batch][int(seqnum) - 1]
+    sample = manifests[batch][int(seqnum) - 1]
+    return check_input(batch, sample, sample.bed)
 
 
 def get_seqnum(_batch, _sample_id):
     return sample_seqnums[(_batch, _sample_id)]
 
 
+def iter_samples():
+    # every sample of the selected batches, in the order of their lists
+    for b, samples in manifests.items():
+        for sample in samples:
+            yield b, sample.seqnum, sample.name
+
+
+assembly_stats = {}  # fasta index -> (length in bp, number of contigs)
+
+
+def get_assembly_stats(index, sample_path):
+    # the fasta index is an input of every tool rule, so it exists by the time
+    # Snakemake evaluates their resources; otherwise estimate the length from
+    # the file size and assume one contig (gzip shrinks assemblies about 4x)
+    if index in assembly_stats:
+        return assembly_stats[index]
+    if os.path.exists(index):
+        length, contigs = 0, 0
+        with open(index, "r") as f:
+            for line in f:
+                if not line.startswith("#"):
+                    length += int(line.split("\t", 2)[1])
+                    contigs += 1
+        assembly_stats[index] = (length, contigs)
+        return length, contigs
+    size = input_sizes.get(sample_path)
+    if size is None:
+        size = os.path.getsize(sample_path) if os.path.exists(sample_path) else 0
+    return size * (4 if is_compressed(sample_path) else 1), 1
+
+
+def get_tool_resources(tool):
+    return config.get("tool_resources", {}).get(tool, {})
+
+
+def get_tool_threads(tool):
+    curve = get_tool_resources(tool)
+
+    def threads(wildcards, input):
+        length, _ = get_assembly_stats(
+            input.index, get_sample_path(wildcards.batch, wildcards.seqnum)
+        )
+        wanted = curve.get("min_threads", 1) + curve.get("threads_per_mbp", 0) * (
+            length / 1e6
+        )
+        max_threads = curve.get("max_threads", config["threads"])
+        return max(1, min(max_threads, math.ceil(wanted)))
+
+    return threads
+
+
+def get_tool_mem_mb(tool):
+    curve = get_tool_resources(tool)
+
+    def mem_mb(wildcards, input, attempt):
+        length, contigs = get_assembly_stats(
+            input.index, get_sample_path(wildcards.batch, wildcards.seqnum)
+        )
+        wanted = (
+            curve.get("mem_mb", 1000)
+            + curve.get("mem_mb_per_mbp", 0) * (length / 1e6)
+            + curve.get("mem_mb_per_contig", 0) * contigs
+        )
+        # a job killed for running out of memory is retried with more
+        return math.ceil(wanted) * attempt
+
+    return mem_mb
+
+
+def load_cost_model():
+    path = config.get("cost_model")
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+cost_model = load_cost_model()
+
+
+def get_tool_priority(tool):
+    # the tools that ran longest on average in earlier runs start first, see
+    # workflow/scripts/cost_model.py
+    mean_seconds = {}
+    for name, entry in cost_model.get("tools", {}).items():
+        runtimes = [seconds for _, _, seconds in entry["observations"].values()]
+        if runtimes:
+            mean_seconds[name] = sum(runtimes) / len(runtimes)
+    if tool not in mean_seconds:
+        return 0
+    return sorted(mean_seconds, key=mean_seconds.get).index(tool) + 1
+
+
+def update_cost_model():
+    # refit the runtimes with the benchmarks of this run; a failure here must
+    # not fail the run itself
+    script = Path(workflow.basedir) / "scripts/cost_model.py"
+    model = config.get("cost_model")
+    intermediate = dir_intermediate()
+    if model:
+        shell(
+            "{script} --model {model} --intermediate_dir {intermediate} fit"
+            " || echo 'Could not update the cost model {model}'"
+        )
+
+
+def tool_cache_args(tool, env, *params, version=""):
+    # the arguments of scripts/tool_cache.py identifying the runs of a tool,
+    # `version` being the command printing the version of the tool; the
+    # cache is disabled when tool_cache_dir is empty
+    args = [
+        "--cache",
+        config.get("tool_cache_dir") or "",
+        "--max_size_gb",
+        str(config.get("tool_cache_max_gb", 0)),
+        "--tool",
+        tool,
+        "--env",
+        str(Path(workflow.basedir) / "envs" / env),
+    ]
+    if version:
+        args += ["--version_command", version]
+    for param in params:
+        args += ["--param", param]
+    return " ".join(shlex.quote(arg) for arg in args)
+
+
+def bed_format_args():
+    # the scripts writing BED files between the post-processing steps write
+    # them in the binary format of scripts/binary_bed.py when binary_beds is set
+    return "--binary_bed" if config.get("binary_beds", False) else ""
+
+
+def fn_cache_hit(tool):
+    # created next to the benchmark of a tool job that restored its outputs
+    # from the tool cache, whose runtime cost_model.py leaves out
+    return f"{dir_intermediate()}/{{batch}}/benchmarks/{tool}/sequence_{{seqnum}}/{{sample}}.cache_hit"
+
+
+def get_tool_fasta(batch, seqnum, sample):
+    # tools that cannot read compressed FASTA get a staged plain copy
+    sample_path = get_sample_path(batch, seqnum)
+    if is_compressed(sample_path):
+        return fn_stagedfasta(batch, seqnum, sample)
+    return sample_path
+
+
+def fn_stagedfasta(batch, seqnum, sample):
+    return f"{dir_intermediate()}/{batch}/staged_fasta/sequence_{seqnum}/{sample}.fa"
+
+
+def fn_fastaindex(batch, seqnum):
+    return f"{dir_intermediate()}/{batch}/fasta_index/sequence_{seqnum}.contigs.tsv"
+
+
 def fn_cleanbed(batch, seqnum):
     return f"{dir_intermediate()}/{batch}/cleaned_beds/sequence_{seqnum}.cleaned.bed"
 
@@ -105,75 +363,68 @@ def fn_callmemobile(batch, seqnum, sample):
     return f"{dir_output()}/{batch}/sequence_{seqnum}-{sample}-callmemobile.tsv"
 
 
+def fn_annotation_index(batch, seqnum, sample):
+    return f"{dir_intermediate()}/{batch}/annotation_index/sequence_{seqnum}/{sample}.json"
+
+
+def fn_aggregate_manifest(batch):
+    return f"{dir_intermediate()}/{batch}/callmemobile_manifest.tsv"
+
+
+def fn_batch_aggregate_rows(batch):
+    rows = []
+    for sample in manifests[batch]:
+        seqnum, sample_base = sample.seqnum, sample.name
+        rows.append(
+            {
+                "bed": fn_cleanbed(batch, seqnum),
+                "integronfinder": fn_integronfinderprocessed(
+                    batch, seqnum, sample_base
+                ),
+                "plasmidfinder": fn_plasmidfinderprocessed(batch, seqnum, sample_base),
+                "mob_suite": fn_mobprocessed(batch, seqnum, sample_base),
+                "phigaro": fn_phigaroprocessed(batch, seqnum, sample_base),
+                "mobileelementfinder": fn_mefinderprocessed(
+                    batch, seqnum, sample_base
+                ),
+                "output": fn_callmemobile(batch, seqnum, sample_base),
+            }
+        )
+    return rows
+
+
 def fn_integronfinder_allout():
-    outputs = []
-    for b in get_batches():
-        for s in get_samples(b):
-            seqnum = get_seqnum(b, s)
-            sample_base = Path(os.path.basename(s)).stem
-            outputs.append(fn_integronfinderprocessed(b, seqnum, sample_base))
-    return outputs
+    return [fn_integronfinderprocessed(*sample) for sample in iter_samples()]
 
 
 def fn_plasmidfinder_allout():
-    outputs = []
-    for b in get_batches():
-        for s in get_samples(b):
-            seqnum = get_seqnum(b, s)
-            sample_base = Path(os.path.basename(s)).stem
-            # outputs.append(f"{dir_intermediate()}/{b}/PlasmidFinder/raw/sequence_{seqnum}/{sample_base}/data.json")
-            outputs.append(fn_plasmidfinderprocessed(b, seqnum, sample_base))
-    return outputs
+    return [fn_plasmidfinderprocessed(*sample) for sample in iter_samples()]
 
 
 def fn_mobrecon_allout():
-    outputs = []
-    for b in get_batches():
-        for s in get_samples(b):
-            seqnum = get_seqnum(b, s)
-            sample_base = Path(os.path.basename(s)).stem
-            # outputs.append(f"{dir_intermediate()}/{b}/mob-suite/raw/sequence_{seqnum}/{sample_base}/contig_report.txt")
-            outputs.append(fn_mobprocessed(b, seqnum, sample_base))
-    return outputs
+    return [fn_mobprocessed(*sample) for sample in iter_samples()]
 
 
 def fn_mobileelementfinder_allout():
-    outputs = []
-    for b in get_batches():
-        for s in get_samples(b):
-            seqnum = get_seqnum(b, s)
-            sample_base = Path(os.path.basename(s)).stem
-            outputs.append(fn_mefinderprocessed(b, seqnum, sample_base))
-    return outputs
+    return [fn_mefinderprocessed(*sample) for sample in iter_samples()]
 
 
 def fn_phispy_allout():
-    outputs = []
-    for b in get_batches():
-        for s in get_samples(b):
-            seqnum = get_seqnum(b, s)
-            sample_base = Path(os.path.basename(s)).stem
-            outputs.append(
-                f"{dir_intermediate()}/{b}/PhiSpy/raw/sequence_{seqnum}/{sample_base}.phispy"
-            )
-    return outputs
+    return [
+        f"{dir_intermediate()}/{b}/PhiSpy/raw/sequence_{seqnum}/{sample_base}.phispy"
+        for b, seqnum, sample_base in iter_samples()
+    ]
 
 
 def fn_phigaro_allout():
-    outputs = []
-    for b in get_batches():
-        for s in get_samples(b):
-            seqnum = get_seqnum(b, s)
-            sample_base = Path(os.path.basename(s)).stem
-            outputs.append(fn_phigaroprocessed(b, seqnum, sample_base))
-    return outputs
+    return [fn_phigaroprocessed(*sample) for sample in iter_samples()]
+
+
+def fn_annotation_index_allout():
+    if not config.get("annotation_index", False):
+        return []
+    return [fn_annotation_index(*sample) for sample in iter_samples()]
 
 
 def fn_callmemobile_allout():
-    outputs = []
-    for b in get_batches():
-        for s in get_samples(b):
-            seqnum = get_seqnum(b, s)
-            sample_base = Path(os.path.basename(s)).stem
-            outputs.append(fn_callmemobile(b, seqnum, sample_base))
-    return outputs
+    return [fn_callmemobile(*sample) for sample in iter_samples()]
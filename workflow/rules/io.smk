@@ -1,20 +1,54 @@
 intermediate_dir = config["intermediate_dir"]
 
 
+rule stage_fasta:
+    output:
+        temp(
+            f"{intermediate_dir}/{{batch}}/staged_fasta/sequence_{{seqnum}}/{{sample}}.fa"
+        ),
+    input:
+        fa=lambda wildcards: get_sample_path(wildcards.batch, wildcards.seqnum),
+    shell:
+        """
+        gzip -dc {input.fa} > {output}
+        """
+
+
+rule fasta_index:
+    output:
+        f"{intermediate_dir}/{{batch}}/fasta_index/sequence_{{seqnum}}.contigs.tsv",
+    input:
+        fa=lambda wildcards: get_sample_path(wildcards.batch, wildcards.seqnum),
+    conda:
+        "../envs/callmemobile.yml"
+    params:
+        script=Path(workflow.basedir) / "scripts/fasta_index.py",
+    shell:
+        """
+        {params.script} \\
+            -f {input.fa} \\
+            -o {output}
+        """
+
+
 rule reformat_bed:
     output:
         f"{intermediate_dir}/{{batch}}/cleaned_beds/sequence_{{seqnum}}.cleaned.bed",
     input:
-        fa=lambda wildcards: get_sample_path(wildcards.batch, wildcards.seqnum),
+        index=lambda wildcards: fn_fastaindex(wildcards.batch, wildcards.seqnum),
         bed=lambda wildcards: get_bed_path(wildcards.batch, wildcards.seqnum),
+    group:
+        "postprocess"
     conda:
         "../envs/callmemobile.yml"
     params:
         script=Path(workflow.basedir) / "scripts/format_bed.py",
+        bed_format=bed_format_args(),
     shell:
         """
         {params.script} \\
             -i {input.bed} \\
             -o {output} \\
-            -f {input.fa}
+            {params.bed_format} \\
+            -x {input.index}
         """
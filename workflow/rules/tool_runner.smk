@@ -5,7 +5,9 @@ rule bakta:
     output:
         f"{intermediate_dir}/{{batch}}/bakta/sequence_{{seqnum}}/{{sample}}.gff3",
     input:
-        fa=lambda wildcards: get_sample_path(wildcards.batch, wildcards.seqnum),
+        fa=lambda wildcards: get_tool_fasta(
+            wildcards.batch, wildcards.seqnum, wildcards.sample
+        ),
     params:
         db=config["bakta_db"],
     conda:
@@ -33,10 +35,27 @@ rule phigaro:
     output:
         f"{intermediate_dir}/{{batch}}/phigaro/raw/sequence_{{seqnum}}/{{sample}}.phigaro.tsv",
     input:
-        fa=lambda wildcards: get_sample_path(wildcards.batch, wildcards.seqnum),
-    threads: config["threads"]
+        fa=lambda wildcards: get_tool_fasta(
+            wildcards.batch, wildcards.seqnum, wildcards.sample
+        ),
+        index=lambda wildcards: fn_fastaindex(wildcards.batch, wildcards.seqnum),
+    benchmark:
+        f"{intermediate_dir}/{{batch}}/benchmarks/phigaro/sequence_{{seqnum}}/{{sample}}.tsv"
+    priority: get_tool_priority("phigaro")
+    threads: get_tool_threads("phigaro")
+    resources:
+        mem_mb=get_tool_mem_mb("phigaro"),
     params:
         pvogdb=config["pvog_db"],
+        cache=Path(workflow.basedir) / "scripts/tool_cache.py",
+        cache_args=tool_cache_args(
+            "phigaro",
+            "phigaro.yml",
+            "options=-d -e tsv",
+            f"pvog_db={config['pvog_db']}",
+            version="phigaro --version",
+        ),
+        cache_hit=fn_cache_hit("phigaro"),
     conda:
         "../envs/phigaro.yml"
     shell:
@@ -45,7 +64,9 @@ rule phigaro:
 
         echo "Processing {input.fa}"
         
-        if [ -s {input.fa} ]; then
+        if {params.cache} restore {params.cache_args} --hit_marker {params.cache_hit} --fasta {input.fa} --sample {wildcards.sample} --output {output}; then
+            echo "Restored {output} from the tool cache."
+        elif [ -s {input.fa} ]; then
             echo "Input file is non-empty."
             
             if [ ! -d {params.pvogdb} ]; then
@@ -63,6 +84,7 @@ rule phigaro:
             if [ "$max_len" -gt 20000 ]; then
                 echo "Found at least one sequence longer than 20kb."
                 phigaro -f {input.fa} -t {threads} -o $(dirname {output}) -d -e tsv
+                {params.cache} store {params.cache_args} --fasta {input.fa} --sample {wildcards.sample} --output {output}
             else
                 echo "Max sequence length ($max_len) does not exceed 20kb. Creating empty output."
                 touch {output}
@@ -78,15 +100,35 @@ rule integron_finder:
     output:
         f"{intermediate_dir}/{{batch}}/IntegronFinder/raw/sequence_{{seqnum}}/Results_Integron_Finder_{{sample}}/{{sample}}.summary",
     input:
-        fa=lambda wildcards: get_sample_path(wildcards.batch, wildcards.seqnum),
+        fa=lambda wildcards: get_tool_fasta(
+            wildcards.batch, wildcards.seqnum, wildcards.sample
+        ),
+        index=lambda wildcards: fn_fastaindex(wildcards.batch, wildcards.seqnum),
+    params:
+        cache=Path(workflow.basedir) / "scripts/tool_cache.py",
+        cache_args=tool_cache_args(
+            "integron_finder",
+            "integronfinder.yml",
+            "options=--local-max",
+            version="integron_finder --version",
+        ),
+        cache_hit=fn_cache_hit("integron_finder"),
     conda:
         "../envs/integronfinder.yml"
-    threads: config["threads"]
+    benchmark:
+        f"{intermediate_dir}/{{batch}}/benchmarks/integron_finder/sequence_{{seqnum}}/{{sample}}.tsv"
+    priority: get_tool_priority("integron_finder")
+    threads: get_tool_threads("integron_finder")
+    resources:
+        mem_mb=get_tool_mem_mb("integron_finder"),
     shell:
         """
         OUTDIR=$(dirname $(dirname {output}))
-        if [ -s {input.fa} ]; then
+        if {params.cache} restore {params.cache_args} --hit_marker {params.cache_hit} --fasta {input.fa} --sample {wildcards.sample} --output $(dirname {output}); then
+            echo "Restored $(dirname {output}) from the tool cache."
+        elif [ -s {input.fa} ]; then
             integron_finder --local-max --cpu {threads} --outdir $OUTDIR {input.fa}
+            {params.cache} store {params.cache_args} --fasta {input.fa} --sample {wildcards.sample} --output $(dirname {output})
         else
             touch {output}
         fi
@@ -97,17 +139,37 @@ rule plasmidfinder:
     output:
         f"{intermediate_dir}/{{batch}}/PlasmidFinder/raw/sequence_{{seqnum}}/{{sample}}/data.json",
     input:
-        fa=lambda wildcards: get_sample_path(wildcards.batch, wildcards.seqnum),
+        fa=lambda wildcards: get_tool_fasta(
+            wildcards.batch, wildcards.seqnum, wildcards.sample
+        ),
+        index=lambda wildcards: fn_fastaindex(wildcards.batch, wildcards.seqnum),
     params:
         mincov=config["plasmidfinder_mincov"],
         threshold=config["plasmidfinder_threshold"],
+        cache=Path(workflow.basedir) / "scripts/tool_cache.py",
+        cache_args=tool_cache_args(
+            "plasmidfinder",
+            "plasmidfinder.yml",
+            f"mincov={config['plasmidfinder_mincov']}",
+            f"threshold={config['plasmidfinder_threshold']}",
+        ),
+        cache_hit=fn_cache_hit("plasmidfinder"),
+    benchmark:
+        f"{intermediate_dir}/{{batch}}/benchmarks/plasmidfinder/sequence_{{seqnum}}/{{sample}}.tsv"
+    priority: get_tool_priority("plasmidfinder")
+    threads: get_tool_threads("plasmidfinder")
+    resources:
+        mem_mb=get_tool_mem_mb("plasmidfinder"),
     conda:
         "../envs/plasmidfinder.yml"
     shell:
         """
         mkdir -p $(dirname {output})
-        if [ -s {input.fa} ]; then
+        if {params.cache} restore {params.cache_args} --hit_marker {params.cache_hit} --fasta {input.fa} --sample {wildcards.sample} --output {output}; then
+            echo "Restored {output} from the tool cache."
+        elif [ -s {input.fa} ]; then
             plasmidfinder.py -i {input.fa} -o $(dirname {output}) --mincov {params.mincov} --threshold {params.threshold}
+            {params.cache} store {params.cache_args} --fasta {input.fa} --sample {wildcards.sample} --output {output}
         else
             touch {output}
         fi
@@ -118,13 +180,33 @@ rule mob_recon:
     output:
         f"{intermediate_dir}/{{batch}}/mob-suite/raw/sequence_{{seqnum}}/{{sample}}/contig_report.txt",
     input:
-        fa=lambda wildcards: get_sample_path(wildcards.batch, wildcards.seqnum),
+        fa=lambda wildcards: get_tool_fasta(
+            wildcards.batch, wildcards.seqnum, wildcards.sample
+        ),
+        index=lambda wildcards: fn_fastaindex(wildcards.batch, wildcards.seqnum),
+    benchmark:
+        f"{intermediate_dir}/{{batch}}/benchmarks/mob_recon/sequence_{{seqnum}}/{{sample}}.tsv"
+    priority: get_tool_priority("mob_recon")
+    threads: get_tool_threads("mob_recon")
+    resources:
+        mem_mb=get_tool_mem_mb("mob_recon"),
+    params:
+        cache=Path(workflow.basedir) / "scripts/tool_cache.py",
+        cache_args=tool_cache_args(
+            "mob_recon", "mobrecon.yml", version="mob_recon --version"
+        ),
+        cache_hit=fn_cache_hit("mob_recon"),
     conda:
         "../envs/mobrecon.yml"
     shell:
         """
-        if [ -s {input.fa} ]; then
-            mob_recon -i {input} -o $(dirname {output}) --force
+        # the classification reads the contig report and the typing of plasmids
+        OUTPUTS="{output} $(dirname {output})/mobtyper_results.txt"
+        if {params.cache} restore {params.cache_args} --hit_marker {params.cache_hit} --fasta {input.fa} --sample {wildcards.sample} --output $OUTPUTS; then
+            echo "Restored {output} from the tool cache."
+        elif [ -s {input.fa} ]; then
+            mob_recon -i {input.fa} -o $(dirname {output}) --num_threads {threads} --force
+            {params.cache} store {params.cache_args} --fasta {input.fa} --sample {wildcards.sample} --output $OUTPUTS
         else
             touch {output}
         fi
@@ -135,14 +217,33 @@ rule mobileelementfinder:
     output:
         f"{intermediate_dir}/{{batch}}/mobileelementfinder/raw/sequence_{{seqnum}}/{{sample}}/mge_results.csv",
     input:
-        fa=lambda wildcards: get_sample_path(wildcards.batch, wildcards.seqnum),
-    threads: config["threads"]
+        fa=lambda wildcards: get_tool_fasta(
+            wildcards.batch, wildcards.seqnum, wildcards.sample
+        ),
+        index=lambda wildcards: fn_fastaindex(wildcards.batch, wildcards.seqnum),
+    benchmark:
+        f"{intermediate_dir}/{{batch}}/benchmarks/mobileelementfinder/sequence_{{seqnum}}/{{sample}}.tsv"
+    priority: get_tool_priority("mobileelementfinder")
+    threads: get_tool_threads("mobileelementfinder")
+    resources:
+        mem_mb=get_tool_mem_mb("mobileelementfinder"),
+    params:
+        cache=Path(workflow.basedir) / "scripts/tool_cache.py",
+        cache_args=tool_cache_args(
+            "mobileelementfinder",
+            "mobileelementfinder.yml",
+            version="mefinder --version",
+        ),
+        cache_hit=fn_cache_hit("mobileelementfinder"),
     conda:
         "../envs/mobileelementfinder.yml"
     shell:
         """
-        if [ -s {input.fa} ]; then
-            mefinder find --contig {input} $(dirname {output})/mge_results -t {threads} --temp-dir $(dirname {output})/tmp-mge
+        if {params.cache} restore {params.cache_args} --hit_marker {params.cache_hit} --fasta {input.fa} --sample {wildcards.sample} --output {output}; then
+            echo "Restored {output} from the tool cache."
+        elif [ -s {input.fa} ]; then
+            mefinder find --contig {input.fa} $(dirname {output})/mge_results -t {threads} --temp-dir $(dirname {output})/tmp-mge
+            {params.cache} store {params.cache_args} --fasta {input.fa} --sample {wildcards.sample} --output {output}
         else
             touch {output}
         fi
@@ -0,0 +1,278 @@
+#!/usr/bin/env python
+"""
+A compiled index of everything the tools found in one assembly: its contigs,
+the normalized features of every tool and the plasmid cluster of every
+contig. The index is built once after the tools finish, then answers the
+callmemobile.tsv table of any BED of regions on that assembly without
+reading the raw tool outputs again.
+"""
+
+import argparse
+import json
+import os
+import sys
+from loguru import logger
+
+from callmemobile import TOOLS, parse_bed_line, write_table
+from fasta_index import (Contig, add_contig_arguments, get_description_to_id,
+                         load_contigs)
+from format_bed import clean_regions
+from integronfinder_analysis import (label_integronfinder,
+                                     read_integronfinderout)
+from intervals import Interval, index_by_chrom, sort_intervals
+from mobileelementfinder_analysis import (iter_mge_results,
+                                          label_mobileelementfinder)
+from mobsuite_analysis import get_contig_plasmids, label_mobrecon
+from phigaro_analysis import label_phigaro, read_tsv
+from plasmidfinder_analysis import read_plasmidfinder_json
+
+# bump when the layout of the index changes
+INDEX_VERSION = 1
+
+
+def build_index(contigs, integronfinder_dir, plasmidfinder_json, mobrecon_dir,
+                phigaro_tsv, mge_csv):
+    """
+    Normalizes the raw outputs of every tool for one assembly into a
+    JSON-serializable index.
+    """
+    description_to_id = get_description_to_id(contigs)
+    # an empty Phigaro output means no prophage was found
+    if os.path.getsize(phigaro_tsv) > 0:
+        prophages = list(read_tsv(phigaro_tsv))
+    else:
+        prophages = []
+    replicons = read_plasmidfinder_json(plasmidfinder_json, description_to_id)
+    is_elements = iter_mge_results(mge_csv, description_to_id)
+    features = {
+        "integronfinder": read_integronfinderout(integronfinder_dir),
+        "plasmidfinder": sort_intervals(replicons),
+        # kept in Phigaro's order, which breaks ties between prophages
+        "phigaro": prophages,
+        "mobileelementfinder": sort_intervals(is_elements),
+    }
+    contig_list = [[contig.id, contig.length, contig.description]
+                   for contig in contigs]
+    return {
+        "version": INDEX_VERSION,
+        "contigs": contig_list,
+        "features": {
+            tool: [[feature.chrom, feature.start, feature.end, feature.fields]
+                   for feature in tool_features]
+            for tool, tool_features in features.items()
+        },
+        "plasmids": get_contig_plasmids(contigs, mobrecon_dir),
+    }
+
+
+def save_index(index, path):
+    # replace the index at once so that a query never reads half of it
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(index, f, separators=(",", ":"))
+    os.replace(tmp, path)
+
+
+def load_index(path):
+    with open(path, "r") as f:
+        index = json.load(f)
+    if index.get("version") != INDEX_VERSION:
+        logger.error(f"{path} is an annotation index of version "
+                     f"{index.get('version')}, not {INDEX_VERSION}. "
+                     "Please rebuild it")
+        sys.exit(2)
+    return index
+
+
+def as_regions(intervals, source):
+    """
+    Converts intervals to the regions callmemobile reads from BED files, so
+    that the columns are parsed exactly as if they had been written out.
+    """
+    regions = []
+    for interval in intervals:
+        region = parse_bed_line(interval.to_line(), source)
+        if region is not None:
+            regions.append(region)
+    return regions
+
+
+def query_index(index, input_bed, output, overlap, prophage_maxdist,
+                mobileelement_maxdist):
+    """
+    Writes the callmemobile.tsv table of the regions in input_bed, like the
+    post-processing of the workflow with the same parameters.
+    """
+    contigs = [
+        Contig(contig_id, description, length)
+        for contig_id, length, description in index["contigs"]
+    ]
+    features = {
+        tool: [
+            Interval(chrom, start, end, fields)
+            for chrom, start, end, fields in tool_features
+        ]
+        for tool, tool_features in index["features"].items()
+    }
+    contig_plasmids = {
+        contig_id: tuple(plasmid)
+        for contig_id, plasmid in index["plasmids"].items()
+    }
+
+    regions = clean_regions(get_description_to_id(contigs), input_bed)
+    # like plasmidfinder_analysis.check_input on the cleaned BED
+    invalid = [region for region in regions if len(region.fields) != 1]
+    if invalid:
+        logger.error(f"Number of columns is {3 + len(invalid[0].fields)}! "
+                     "This is not 4! Please make it 4 columns!")
+        sys.exit(2)
+
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    if not regions:
+        open(output, "w").close()
+        return
+
+    indexes = {tool: index_by_chrom(features[tool]) for tool in features}
+    integron_regions = label_integronfinder(regions, indexes["integronfinder"],
+                                            overlap)
+    labelled = {
+        "integronfinder":
+        as_regions(integron_regions, input_bed),
+        # like the plasmidfinder_bed rule, report the replicons themselves
+        "plasmidfinder":
+        as_regions(features["plasmidfinder"], input_bed),
+        "mob_suite":
+        as_regions(label_mobrecon(regions, contig_plasmids, True), input_bed),
+        "phigaro":
+        as_regions(
+            label_phigaro(regions, indexes["phigaro"], prophage_maxdist, True),
+            input_bed),
+        "mobileelementfinder":
+        as_regions(
+            label_mobileelementfinder(regions, indexes["mobileelementfinder"],
+                                      mobileelement_maxdist, True), input_bed),
+    }
+    tool_indexes = {
+        tool_name: index_by_chrom(labelled[option])
+        for tool_name, option in TOOLS
+    }
+    # cleaned regions are sorted and deduplicated
+    write_table(as_regions(regions, input_bed),
+                tool_indexes,
+                output,
+                stream=True,
+                presorted=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Build the annotation index of an assembly from the raw "
+        "outputs of the tools, or query it with a BED of regions to write "
+        "their callmemobile.tsv table.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build = subparsers.add_parser(
+        "build", help="Build the annotation index of an assembly")
+    add_contig_arguments(build)
+    build.add_argument(
+        "--integronfinder",
+        help="[REQUIRED] Path to IntegronFinder's output directory",
+        type=os.path.abspath,
+        required=True,
+    )
+    build.add_argument(
+        "--plasmidfinder",
+        help="[REQUIRED] Path to plasmidfinder's data.json output",
+        type=os.path.abspath,
+        required=True,
+    )
+    build.add_argument(
+        "--mob_suite",
+        help="[REQUIRED] Path to mob_recon's output directory",
+        type=os.path.abspath,
+        required=True,
+    )
+    build.add_argument(
+        "--phigaro",
+        help="[REQUIRED] Path to Phigaro's TSV output",
+        type=os.path.abspath,
+        required=True,
+    )
+    build.add_argument(
+        "--mobileelementfinder",
+        help="[REQUIRED] Path to mobileelementfinder's output csv",
+        type=os.path.abspath,
+        required=True,
+    )
+    build.add_argument(
+        "--output",
+        "-o",
+        help="[REQUIRED] Path to the annotation index",
+        type=os.path.abspath,
+        required=True,
+    )
+
+    query = subparsers.add_parser(
+        "query", help="Write the callmemobile.tsv table of a BED of regions")
+    query.add_argument(
+        "--index",
+        "-x",
+        help="[REQUIRED] Path to the annotation index of the assembly",
+        type=os.path.abspath,
+        required=True,
+    )
+    query.add_argument(
+        "--bed",
+        "-b",
+        help="[REQUIRED] Path to the input bed file, may be gzip compressed",
+        type=os.path.abspath,
+        required=True,
+    )
+    # no defaults, so that a query always uses the parameters of the run
+    query.add_argument(
+        "--overlap",
+        "-bo",
+        help="[REQUIRED] Percentage of an Integron element to overlap with "
+        "the input bed in order to be classified as mobile, integron_pctolap "
+        "in config.yaml",
+        type=float,
+        required=True)
+    query.add_argument(
+        "--prophage_maxdist",
+        help="[REQUIRED] Max distance to consider near a prophage, "
+        "prophage_maxdist in config.yaml",
+        type=int,
+        required=True)
+    query.add_argument(
+        "--mobileelement_maxdist",
+        help="[REQUIRED] Max. dist. to consider as mobile when sandwiched "
+        "between two MGEs of the same type, mobileelement_maxdist in "
+        "config.yaml",
+        type=int,
+        required=True)
+    query.add_argument("--output",
+                       "-o",
+                       help="[REQUIRED] Path to the aggregated output file",
+                       type=os.path.abspath,
+                       required=True)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        contigs = load_contigs(args.index, args.fasta)
+        index = build_index(contigs, args.integronfinder, args.plasmidfinder,
+                            args.mob_suite, args.phigaro,
+                            args.mobileelementfinder)
+        save_index(index, args.output)
+        logger.success(f"Saved the annotation index to {args.output}")
+    else:
+        query_index(load_index(args.index),
+                    args.bed,
+                    args.output,
+                    overlap=args.overlap,
+                    prophage_maxdist=args.prophage_maxdist,
+                    mobileelement_maxdist=args.mobileelement_maxdist)
+        logger.success(f"Completed querying {args.index} for {args.bed}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+"""
+The lists of a batch, shared by init.smk and the scripts reading them: line
+N of `{batch}.txt` and `{batch}.beds` are the assembly and the BED of
+sequence N.
+"""
+
+import os
+
+
+def is_compressed(path):
+    return str(path).endswith((".gz", ".bgz"))
+
+
+def get_sample_name(sample_path):
+    # assembly.fa and assembly.fa.gz are both named assembly
+    name = os.path.basename(sample_path)
+    if is_compressed(name):
+        name = os.path.splitext(name)[0]
+    return os.path.splitext(name)[0]
+
+
+def read_list(path):
+    with open(path, "r") as f:
+        return [line.strip() for line in f]
+
+
+def read_batch_lists(batch, txt, bed_list):
+    """
+    Returns the (assembly, bed) paths of every sequence of a batch. Raises
+    ValueError when the lists differ in length.
+    """
+    sample_paths = read_list(txt)
+    bed_paths = read_list(bed_list)
+    if len(sample_paths) != len(bed_paths):
+        raise ValueError(
+            f"Batch {batch} lists {len(sample_paths)} assemblies in {txt} but "
+            f"{len(bed_paths)} bed files in {bed_list}")
+    return list(zip(sample_paths, bed_paths))
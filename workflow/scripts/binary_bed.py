@@ -0,0 +1,163 @@
+"""
+A columnar binary alternative to text BED files, handed between the steps of
+the workflow. Chromosomes and the columns after the end coordinate are
+dictionary encoded, and every column is an aligned array that readers map
+in memory and use in place, without parsing or copying the file.
+
+Layout, little-endian:
+    magic (8 bytes), length of the metadata (8 bytes), metadata (JSON padded
+    to 8 bytes), then every column padded to 8 bytes, at the offsets in the
+    metadata counted from the end of the metadata.
+
+A BED without regions is an empty file, like its text counterpart.
+"""
+
+import json
+import mmap
+import struct
+import sys
+from array import array
+
+MAGIC = b"CMMBED\x01\n"
+
+# column name, array type code
+COLUMNS = [
+    ("chroms", "I"),  # string code of the chromosome
+    ("starts", "q"),
+    ("ends", "q"),
+    ("field_offsets", "Q"),  # row i has the fields between offsets i and i+1
+    ("fields", "I"),  # string codes of the columns after the end
+    ("string_offsets", "Q"),  # string i is between offsets i and i+1
+    ("strings", "B"),  # UTF-8 bytes of every distinct string
+]
+
+
+def is_binary_bed(path):
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def padding(length):
+    return -length % 8
+
+
+def write_binary_bed(rows, output, header=None):
+    """
+    Writes (chrom, start, end, fields) rows to `output`. `header` is kept
+    in the metadata in place of the first line of a text BED.
+    """
+    codes = {}
+
+    def encode(string):
+        code = codes.get(string)
+        if code is None:
+            code = codes[string] = len(codes)
+        return code
+
+    columns = {name: array(typecode) for name, typecode in COLUMNS}
+    columns["field_offsets"].append(0)
+    for chrom, start, end, fields in rows:
+        columns["chroms"].append(encode(chrom))
+        columns["starts"].append(start)
+        columns["ends"].append(end)
+        columns["fields"].extend(encode(field) for field in fields)
+        columns["field_offsets"].append(len(columns["fields"]))
+    if not columns["chroms"]:
+        open(output, "wb").close()
+        return
+
+    columns["string_offsets"].append(0)
+    for string in codes:
+        columns["strings"].frombytes(string.encode())
+        columns["string_offsets"].append(len(columns["strings"]))
+
+    if sys.byteorder != "little":
+        for name, typecode in COLUMNS:
+            columns[name].byteswap()
+    # columns are placed one after the other from the end of the metadata
+    layout = {}
+    offset = 0
+    for name, column in columns.items():
+        size = len(column) * column.itemsize
+        layout[name] = [offset, size]
+        offset += size + padding(size)
+    metadata = json.dumps({
+        "header": header,
+        "rows": len(columns["chroms"]),
+        "columns": layout
+    }).encode()
+    metadata += b" " * padding(len(metadata))
+
+    with open(output, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<Q", len(metadata)))
+        f.write(metadata)
+        for name, column in columns.items():
+            column.tofile(f)
+            f.write(b"\0" * padding(layout[name][1]))
+
+
+class BinaryBed:
+    """
+    A binary BED mapped in memory. Every column is a memoryview of the
+    mapping, and strings are only decoded the first time they are used.
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._map)
+        (length, ) = struct.unpack_from("<Q", view, len(MAGIC))
+        start = len(MAGIC) + 8
+        metadata = json.loads(bytes(view[start:start + length]))
+        self.header = metadata["header"]
+        self.columns = {}
+        for name, typecode in COLUMNS:
+            offset, size = metadata["columns"][name]
+            offset += start + length
+            column = view[offset:offset + size].cast(typecode)
+            if sys.byteorder != "little":
+                column = array(typecode, column)
+                column.byteswap()
+            self.columns[name] = column
+        self._strings = {}
+
+    def __len__(self):
+        return len(self.columns["chroms"])
+
+    def string(self, code):
+        string = self._strings.get(code)
+        if string is None:
+            offsets = self.columns["string_offsets"]
+            strings = self.columns["strings"]
+            string = bytes(strings[offsets[code]:offsets[code + 1]]).decode()
+            self._strings[code] = string
+        return string
+
+    def rows(self):
+        """
+        Yields the (chrom, start, end, fields) of every row.
+        """
+        chroms = self.columns["chroms"]
+        starts = self.columns["starts"]
+        ends = self.columns["ends"]
+        field_offsets = self.columns["field_offsets"]
+        fields = self.columns["fields"]
+        string = self.string
+        for i in range(len(chroms)):
+            yield (string(chroms[i]), starts[i], ends[i], [
+                string(code)
+                for code in fields[field_offsets[i]:field_offsets[i + 1]]
+            ])
+
+    def close(self):
+        for column in self.columns.values():
+            if isinstance(column, memoryview):
+                column.release()
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -1,9 +1,25 @@
 #!/usr/bin/env python
 
 import argparse
+import itertools
+import os
 import sys
+from collections import Counter
 from loguru import logger
 
+from fileio import open_text
+from binary_bed import is_binary_bed
+from intervals import index_by_chrom, is_sorted_bed, iter_binary_bed
+
+# (output column, command line option) of each supported tool
+TOOLS = [
+    ("IntegronFinder", "integronfinder"),
+    ("PlasmidFinder", "plasmidfinder"),
+    ("mob_suite", "mob_suite"),
+    ("phigaro", "phigaro"),
+    ("mobileelementfinder", "mobileelementfinder"),
+]
+
 
 def parse_arguments():
     parser = argparse.ArgumentParser(
@@ -38,142 +54,239 @@ def parse_arguments():
                         "-o",
                         help="[REQUIRED] Path to output file",
                         required=True)
+    parser.add_argument(
+        "--stream",
+        help="Process the input BED one chromosome at a time, writing rows "
+        "as each chromosome finishes. Regions of a chromosome must be "
+        "contiguous in the input BED.",
+        action="store_true",
+    )
     return parser.parse_args()
 
 
-def read_bed_file(bed_file_path):
-    regions = []
-    with open(bed_file_path, "r") as f:
+class BedRegion:
+    __slots__ = ("chrom", "start", "end", "name", "annotation")
+
+    def __init__(self, chrom, start, end, name, annotation):
+        self.chrom = chrom
+        self.start = start
+        self.end = end
+        self.name = name
+        self.annotation = annotation
+
+    def key(self):
+        return (self.chrom, self.start, self.end, self.name)
+
+
+def parse_bed_line(line, source):
+    """
+    Returns the region of a BED line, or None for comments, blank lines and
+    invalid lines.
+    """
+    if line.startswith("#") or line.strip() == "":
+        return None
+    fields = line.strip().split("\t")
+    if len(fields) < 3:
+        logger.error(f"Invalid BED line in {source}: {line.strip()}")
+        return None
+    name = fields[3] if len(fields) > 3 else ""
+    # the annotation reported for a tool region is its name followed by any
+    # remaining columns
+    annotation = "|".join(fields[3:]) if len(fields) > 4 else name
+    return BedRegion(fields[0], int(fields[1]), int(fields[2]), name,
+                     annotation)
+
+
+def region_from_interval(interval, source):
+    """
+    Returns the region of an interval read from a binary BED, the same as
+    parse_bed_line returns for its text line.
+    """
+    chrom, fields = interval.chrom, interval.fields
+    # strip() would change these lines, leave them to the text parser
+    if (not chrom or chrom[0] == "#" or chrom[0].isspace()
+            or (fields and fields[-1] != fields[-1].rstrip())
+            or (fields and not fields[-1])):
+        return parse_bed_line(interval.to_line(), source)
+    name = fields[0] if fields else ""
+    annotation = "|".join(fields) if len(fields) > 1 else name
+    return BedRegion(chrom, interval.start, interval.end, name, annotation)
+
+
+def iter_bed_file(bed_file_path):
+    if is_binary_bed(bed_file_path):
+        for interval in iter_binary_bed(bed_file_path):
+            region = region_from_interval(interval, bed_file_path)
+            if region is not None:
+                yield region
+        return
+    with open_text(bed_file_path) as f:
         for line in f:
-            if line.startswith("#") or line.strip() == "":
-                continue
-            fields = line.strip().split("\t")
-            if len(fields) < 3:
-                logger.error(
-                    f"Invalid BED line in {bed_file_path}: {line.strip()}")
-                continue
-            chrom = fields[0]
-            start = int(fields[1])
-            end = int(fields[2])
-            name = fields[3] if len(fields) > 3 else ""
-            other_fields = fields[4:] if len(fields) > 4 else []
-            regions.append({
-                "chrom": chrom,
-                "start": start,
-                "end": end,
-                "name": name,
-                "other_fields": other_fields,
-            })
-    return regions
-
-
-def regions_overlap(region1, region2):
-    if region1["chrom"] != region2["chrom"]:
-        return False
-    # Check if regions overlap
-    return not (region1["end"] <= region2["start"]
-                or region2["end"] <= region1["start"])
+            region = parse_bed_line(line, bed_file_path)
+            if region is not None:
+                yield region
 
 
-def main():
-    args = parse_arguments()
+def read_bed_file(bed_file_path):
+    return list(iter_bed_file(bed_file_path))
 
-    # Check that at least one tool output is provided
-    if not any([
-            args.integronfinder,
-            args.plasmidfinder,
-            args.mob_suite,
-            args.phigaro,
-            args.mobileelementfinder,
-    ]):
-        logger.error("At least one tool output must be provided.")
-        sys.exit(1)
 
-    # Read input BED file
-    logger.info(f"Reading input BED file: {args.bed}")
-    input_regions = read_bed_file(args.bed)
+def join_annotations(annotations):
+    # empty annotations are dropped until the first non-empty one, after
+    # that every annotation is kept
+    for i, annotation in enumerate(annotations):
+        if annotation:
+            return ";".join(annotations[i:])
+    return "no"
 
-    if not input_regions:
-        logger.error("No valid regions found in input BED file.")
-        sys.exit(1)
 
-    # Initialize tool outputs
-    tool_bed_regions = {}
-    if args.integronfinder:
-        logger.info(f"Reading IntegronFinder BED file: {args.integronfinder}")
-        tool_bed_regions["IntegronFinder"] = read_bed_file(args.integronfinder)
-    if args.plasmidfinder:
-        logger.info(f"Reading PlasmidFinder BED file: {args.plasmidfinder}")
-        tool_bed_regions["PlasmidFinder"] = read_bed_file(args.plasmidfinder)
-    if args.mob_suite:
-        logger.info(f"Reading mob-suite BED file: {args.mob_suite}")
-        tool_bed_regions["mob_suite"] = read_bed_file(args.mob_suite)
-    if args.phigaro:
-        logger.info(f"Reading phigaro BED file: {args.phigaro}")
-        tool_bed_regions["phigaro"] = read_bed_file(args.phigaro)
-    if args.mobileelementfinder:
-        logger.info(
-            f"Reading mobileelementfinder BED file: {args.mobileelementfinder}"
-        )
-        tool_bed_regions["mobileelementfinder"] = read_bed_file(
-            args.mobileelementfinder)
-
-    tools = list(tool_bed_regions.keys())
-
-    # Initialize overlap dictionary
-    overlap_dict = {}
+def annotate_regions(input_regions, tool_indexes):
+    """
+    Yields one output row per input region with the hits of every tool.
+    """
+    # Regions listed more than once collect their hits once per occurrence
+    occurrences = Counter(region.key() for region in input_regions)
+    values = {}
     for region in input_regions:
-        key = (region["chrom"], region["start"], region["end"], region["name"])
-        overlap_dict[key] = {tool_name: None for tool_name in tools}
-
-    # For each tool, perform overlap check and populate overlap_dict
-    for tool_name, tool_regions in tool_bed_regions.items():
-        logger.info(f"Processing overlaps with {tool_name}")
-        for input_region in input_regions:
-            key = (
-                input_region["chrom"],
-                input_region["start"],
-                input_region["end"],
-                input_region["name"],
-            )
-            for tool_region in tool_regions:
-                if regions_overlap(input_region, tool_region):
-                    # Get annotation from tool region
-                    annotation = tool_region["name"]
-                    if tool_region["other_fields"]:
-                        annotation += "|" + "|".join(
-                            tool_region["other_fields"])
-                    if overlap_dict[key][tool_name]:
-                        overlap_dict[key][tool_name] += f";{annotation}"
-                    else:
-                        overlap_dict[key][tool_name] = annotation
-                    # Break if overlap is found to prevent multiple counts
-                    # Remove the above line if multiple overlaps per region are possible
-                    # break
+        key = region.key()
+        if key not in values:
+            values[key] = []
+            for index in tool_indexes.values():
+                if region.chrom in index:
+                    hits = [
+                        hit.annotation
+                        for hit in index[region.chrom].overlapping(
+                            region.start, region.end, input_order=True)
+                    ]
+                else:
+                    hits = []
+                values[key].append(join_annotations(hits * occurrences[key]))
+        yield "\t".join([
+            region.chrom,
+            str(region.start),
+            str(region.end),
+            region.name,
+        ] + values[key]) + "\n"
+
+
+def annotate_sorted_regions(chrom, regions, tool_indexes):
+    """
+    Yields the rows of annotate_regions for the sorted, deduplicated regions
+    of one chromosome, sweeping each tool's regions once alongside them.
+    """
+    columns = []
+    for index in tool_indexes.values():
+        if chrom in index:
+            columns.append([
+                join_annotations([hit.annotation for hit in hits])
+                for hits in index[chrom].sweep(regions, input_order=True)
+            ])
+        else:
+            columns.append(["no"] * len(regions))
+    for i, region in enumerate(regions):
+        yield "\t".join([
+            region.chrom,
+            str(region.start),
+            str(region.end),
+            region.name,
+        ] + [column[i] for column in columns]) + "\n"
+
+
+def write_table(input_regions,
+                tool_indexes,
+                output,
+                stream=False,
+                presorted=False):
+    """
+    Writes the aggregated table for `input_regions` to `output`. With
+    `stream`, the regions of a chromosome must be contiguous, and with
+    `presorted` they must also be sorted and deduplicated. `tool_indexes`
+    maps each tool column name to its regions indexed by chromosome.
+    Returns False if there is no region.
+    """
+    if stream:
+        input_regions = iter(input_regions)
+        first_region = next(input_regions, None)
+        if first_region is not None:
+            input_regions = itertools.chain([first_region], input_regions)
+    else:
+        input_regions = list(input_regions)
+        first_region = input_regions[0] if input_regions else None
+
+    if first_region is None:
+        return False
 
     # Output results
-    with open(args.output, "w") as out_f:
-        header = ["#chrom", "start", "end", "name"] + tools
+    with open(output, "w") as out_f:
+        header = ["#chrom", "start", "end", "name"] + list(tool_indexes)
         out_f.write("\t".join(header) + "\n")
-        for region in input_regions:
-            key = (
-                region["chrom"],
-                region["start"],
-                region["end"],
-                region["name"],
-            )
-            values = [
-                region["chrom"],
-                str(region["start"]),
-                str(region["end"]),
-                region["name"],
-            ]
-            for tool_name in tools:
-                value = overlap_dict[key][tool_name] if overlap_dict[key][
-                    tool_name] else "no"
-                values.append(value)
-            out_f.write("\t".join(values) + "\n")
-    logger.info(f"Aggregation complete. Output written to {args.output}")
+        if stream:
+            seen_chroms = set()
+            for chrom, regions in itertools.groupby(
+                    input_regions, key=lambda region: region.chrom):
+                # a chromosome coming back would be aggregated twice
+                if chrom in seen_chroms:
+                    out_f.close()
+                    os.remove(output)
+                    logger.error(
+                        f"The regions of {chrom} are not contiguous in the "
+                        "input BED. Sort it or aggregate without --stream.")
+                    sys.exit(1)
+                seen_chroms.add(chrom)
+                logger.debug(f"Processing overlaps on {chrom}")
+                if presorted:
+                    out_f.writelines(
+                        annotate_sorted_regions(chrom, list(regions),
+                                                tool_indexes))
+                else:
+                    out_f.writelines(
+                        annotate_regions(list(regions), tool_indexes))
+        else:
+            logger.info("Processing overlaps")
+            out_f.writelines(annotate_regions(input_regions, tool_indexes))
+    logger.info(f"Aggregation complete. Output written to {output}")
+    return True
+
+
+def aggregate(bed, tool_beds, output, stream=False):
+    """
+    Writes the aggregated table for the regions in `bed` to `output`.
+    `tool_beds` maps each tool column name to its processed BED file.
+    Returns False if the input BED holds no valid region.
+    """
+    tool_indexes = {}
+    for tool_name, tool_bed in tool_beds.items():
+        logger.info(f"Reading {tool_name} BED file: {tool_bed}")
+        tool_indexes[tool_name] = index_by_chrom(iter_bed_file(tool_bed))
+
+    # Read input BED file
+    logger.info(f"Reading input BED file: {bed}")
+    # the regions of a cleaned BED are sorted, so each chromosome is
+    # contiguous and can be merged with the tool regions in one sweep
+    presorted = is_sorted_bed(bed)
+    if presorted:
+        stream = True
+    input_regions = iter_bed_file(bed) if stream else read_bed_file(bed)
+    if not write_table(input_regions, tool_indexes, output, stream, presorted):
+        logger.error(f"No valid regions found in input BED file {bed}.")
+        return False
+    return True
+
+
+def main():
+    args = parse_arguments()
+
+    # Tool outputs, in the order of the output columns
+    tool_beds = {
+        tool_name: getattr(args, option)
+        for tool_name, option in TOOLS if getattr(args, option)
+    }
+    if not tool_beds:
+        logger.error("At least one tool output must be provided.")
+        sys.exit(1)
+
+    if not aggregate(args.bed, tool_beds, args.output, args.stream):
+        sys.exit(1)
 
 
 if __name__ == "__main__":
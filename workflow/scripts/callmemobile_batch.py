@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+import argparse
+import csv
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from loguru import logger
+
+from callmemobile import TOOLS, aggregate
+
+
+def read_manifest(manifest):
+    """
+    Reads a batch manifest: a TSV with a header naming the `bed`, `output`
+    and tool BED columns, and one row per sample.
+    """
+    with open(manifest, "r", newline="") as f:
+        reader = csv.DictReader(f, delimiter="\t")
+        required = ["bed", "output"] + [option for _, option in TOOLS]
+        missing = [
+            column for column in required
+            if column not in (reader.fieldnames or [])
+        ]
+        if missing:
+            logger.error(
+                f"Manifest {manifest} is missing the columns: {missing}")
+            sys.exit(2)
+        return list(reader)
+
+
+def aggregate_sample(sample, stream=False):
+    tool_beds = {
+        tool_name: sample[option]
+        for tool_name, option in TOOLS if sample[option]
+    }
+    # mirror `rule aggregate_output`: an empty input BED gives an empty table
+    if os.path.getsize(sample["bed"]) == 0:
+        open(sample["output"], "w").close()
+        return True
+    return aggregate(sample["bed"], tool_beds, sample["output"], stream)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Aggregate mobile element predictions for every sample "
+        "of a batch.")
+    parser.add_argument(
+        "--manifest",
+        "-m",
+        help="[REQUIRED] Path to the batch manifest TSV",
+        type=os.path.abspath,
+        required=True,
+    )
+    parser.add_argument(
+        "--threads",
+        "-t",
+        help="Number of worker processes. Default is 1.",
+        type=int,
+        default=1,
+        required=False,
+    )
+    parser.add_argument(
+        "--stream",
+        help="Process each input BED one chromosome at a time",
+        action="store_true",
+    )
+    args = parser.parse_args()
+
+    samples = read_manifest(args.manifest)
+    logger.info(f"Aggregating {len(samples)} samples from {args.manifest}")
+    streams = [args.stream] * len(samples)
+    if args.threads > 1:
+        with ProcessPoolExecutor(max_workers=args.threads) as executor:
+            chunksize = max(1, len(samples) // (args.threads * 4))
+            results = list(
+                executor.map(aggregate_sample,
+                             samples,
+                             streams,
+                             chunksize=chunksize))
+    else:
+        results = list(map(aggregate_sample, samples, streams))
+
+    failed = [sample["bed"] for sample, ok in zip(samples, results) if not ok]
+    if failed:
+        logger.error(f"Aggregation failed for {len(failed)} samples")
+        for bed in failed:
+            logger.error(bed)
+        sys.exit(1)
+    logger.success(f"Completed aggregation of {len(samples)} samples")
+
+
+if __name__ == "__main__":
+    main()
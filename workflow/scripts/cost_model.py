@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+
+import argparse
+import glob
+import json
+import math
+import os
+import sys
+from loguru import logger
+
+from fasta_index import read_index
+from postprocess_batch import read_batches, sample_paths
+
+# the tool rules and the key of their raw output in sample_paths
+TOOL_OUTPUTS = {
+    "phigaro": "phigaro",
+    "integron_finder": "integronfinder",
+    "plasmidfinder": "plasmidfinder",
+    "mob_recon": "mob_suite",
+    "mobileelementfinder": "mobileelementfinder",
+}
+
+# the guess for tools without any recorded runtime yet
+DEFAULT_SECONDS_PER_MBP = 60
+
+
+def load_model(path):
+    if not os.path.exists(path):
+        return {"tools": {}}
+    with open(path, "r") as f:
+        try:
+            return json.load(f)
+        except json.JSONDecodeError as e:
+            logger.warning(f"Ignoring unreadable cost model {path}: {e}")
+            return {"tools": {}}
+
+
+def save_model(model, path):
+    # replace the model at once so that a parallel run never reads half of it
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(model, f, indent=1, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def assembly_size(index):
+    contigs = read_index(index)
+    return sum(contig.length for contig in contigs) / 1e6, len(contigs)
+
+
+def estimate_size(sample_path):
+    # like init.smk, gzip shrinks assemblies about four times
+    if not os.path.exists(sample_path):
+        return 0.0
+    size = os.path.getsize(sample_path)
+    if sample_path.endswith((".gz", ".bgz")):
+        size *= 4
+    return size / 1e6
+
+
+def read_benchmark(path):
+    """
+    Returns the wall clock seconds recorded in a Snakemake benchmark file.
+    """
+    with open(path, "r") as f:
+        header = f.readline().rstrip("\n").split("\t")
+        values = f.readline().rstrip("\n").split("\t")
+    return float(values[header.index("s")])
+
+
+def collect_observations(intermediate_dir):
+    """
+    Yields the tool, sample key, assembly size in Mbp, number of contigs and
+    runtime of every benchmarked tool job with a fasta index that ran the
+    tool rather than restoring its outputs from the tool cache.
+    """
+    pattern = os.path.join(intermediate_dir, "*", "benchmarks", "*",
+                           "sequence_*", "*.tsv")
+    for path in glob.glob(pattern):
+        batch, _, tool, sequence, filename = path.split(os.sep)[-5:]
+        sample = filename[:-len(".tsv")]
+        if tool not in TOOL_OUTPUTS:
+            continue
+        # the job restored the outputs from the tool cache in no time
+        if os.path.exists(f"{path[:-len('.tsv')]}.cache_hit"):
+            continue
+        index = os.path.join(intermediate_dir, batch, "fasta_index",
+                             f"{sequence}.contigs.tsv")
+        if not os.path.exists(index):
+            continue
+        try:
+            seconds = read_benchmark(path)
+        except (ValueError, IndexError):
+            logger.warning(f"Skipping incomplete benchmark {path}")
+            continue
+        mbp, contigs = assembly_size(index)
+        yield tool, f"{batch}/{sequence}/{sample}", mbp, contigs, seconds
+
+
+def fit_line(observations):
+    """
+    Least squares fit of the runtime against the assembly size, kept
+    non-negative so that larger assemblies never look cheaper.
+    """
+    n = len(observations)
+    mean_x = sum(x for x, _, _ in observations) / n
+    mean_y = sum(y for _, _, y in observations) / n
+    sxx = sum((x - mean_x)**2 for x, _, _ in observations)
+    sxy = sum((x - mean_x) * (y - mean_y) for x, _, y in observations)
+    slope = sxy / sxx if sxx > 0 else 0.0
+    if slope < 0:
+        slope = 0.0
+    intercept = max(0.0, mean_y - slope * mean_x)
+    return intercept, slope
+
+
+def update_model(model, intermediate_dir):
+    """
+    Adds the runtimes recorded since the last run to the model and refits
+    every tool. Observations are kept by sample, so rerunning a job replaces
+    its previous runtime instead of counting it twice.
+    """
+    tools = model.setdefault("tools", {})
+    added = 0
+    for tool, key, mbp, contigs, seconds in collect_observations(
+            intermediate_dir):
+        entry = tools.setdefault(tool, {})
+        entry.setdefault("observations", {})[key] = [mbp, contigs, seconds]
+        added += 1
+    for tool, entry in tools.items():
+        observations = list(entry.get("observations", {}).values())
+        if observations:
+            entry["intercept"], entry["slope"] = fit_line(observations)
+            logger.info(
+                f"{tool}: {entry['intercept']:.1f} s + {entry['slope']:.1f} "
+                f"s/Mbp from {len(observations)} runs")
+    logger.info(f"Read {added} benchmarks")
+    return model
+
+
+def predict(model, tool, mbp):
+    entry = model.get("tools", {}).get(tool, {})
+    if "slope" not in entry:
+        return DEFAULT_SECONDS_PER_MBP * mbp
+    return entry["intercept"] + entry["slope"] * mbp
+
+
+def longest_jobs(model, manifests, intermediate_dir, fraction):
+    """
+    Returns the outputs of the tool jobs still to run with the longest
+    predicted runtimes, longest first.
+    """
+    jobs = []
+    for batch, samples in manifests.items():
+        for seqnum, (sample_path, bed_path) in enumerate(samples, start=1):
+            paths = sample_paths(intermediate_dir, "", batch, seqnum,
+                                 sample_path, bed_path)
+            if os.path.exists(paths["index"]):
+                mbp, _ = assembly_size(paths["index"])
+            else:
+                mbp = estimate_size(sample_path)
+            for tool, output in TOOL_OUTPUTS.items():
+                raw = paths["raw"][output]
+                if not os.path.exists(raw):
+                    jobs.append((predict(model, tool, mbp), raw))
+    jobs.sort(reverse=True)
+    return [raw for _, raw in jobs[:math.ceil(fraction * len(jobs))]]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Fit the runtime of every tool to the assembly size from "
+        "Snakemake benchmarks, and list the tool jobs predicted to run longest "
+        "so that they can be started first.")
+    parser.add_argument(
+        "--model",
+        "-m",
+        help="[REQUIRED] Path to the cost model, a JSON file",
+        required=True,
+    )
+    parser.add_argument(
+        "--intermediate_dir",
+        help="Directory of the intermediate files. Default is intermediate",
+        default="intermediate",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser(
+        "fit",
+        help="Add the runtimes of the latest run to the model and refit it")
+    longest = subparsers.add_parser(
+        "longest",
+        help="Print the outputs of the tool jobs predicted to run longest")
+    longest.add_argument(
+        "--input_dir",
+        help="Directory with the {batch}.txt and {batch}.beds lists. "
+        "Default is input",
+        default="input",
+    )
+    longest.add_argument(
+        "--fraction",
+        help="Fraction of the tool jobs still to run to print. Default is 0.1",
+        type=float,
+        default=0.1,
+    )
+    args = parser.parse_args()
+
+    model = load_model(args.model)
+    if args.command == "fit":
+        save_model(update_model(model, args.intermediate_dir), args.model)
+        logger.success(f"Saved the cost model to {args.model}")
+    else:
+        if not 0 <= args.fraction <= 1:
+            logger.error("--fraction must be between 0 and 1")
+            sys.exit(2)
+        manifests = read_batches(args.input_dir)
+        for raw in longest_jobs(model, manifests, args.intermediate_dir,
+                                args.fraction):
+            print(raw)
+
+
+if __name__ == "__main__":
+    main()
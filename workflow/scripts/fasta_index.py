@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+
+import argparse
+import os
+import sys
+from loguru import logger
+
+from fileio import open_text
+
+
+class Contig:
+    __slots__ = ("id", "description", "length")
+
+    def __init__(self, id, description, length):
+        self.id = id
+        self.description = description
+        self.length = length
+
+
+def scan_fasta(input_fasta):
+    """
+    Yields the identifier, full header and length of every record of a FASTA
+    file without keeping any sequence in memory. Identifiers and headers
+    follow Biopython's conventions.
+    """
+    contig = None
+    with open_text(input_fasta) as f:
+        for line in f:
+            if line.startswith(">"):
+                if contig is not None:
+                    yield contig
+                description = line[1:].rstrip()
+                words = description.split(None, 1)
+                contig = Contig(words[0] if words else "", description, 0)
+            elif contig is not None:
+                contig.length += len(line.rstrip().replace(" ", ""))
+    if contig is not None:
+        yield contig
+
+
+def write_index(contigs, output):
+    with open(output, "w") as f:
+        f.write("#id\tlength\tdescription\n")
+        for contig in contigs:
+            f.write(f"{contig.id}\t{contig.length}\t{contig.description}\n")
+
+
+def read_index(index):
+    contigs = []
+    with open(index, "r") as f:
+        for line in f:
+            if line.startswith("#"):
+                continue
+            fields = line.rstrip("\n").split("\t", 2)
+            if len(fields) != 3:
+                logger.error(f"Invalid line in FASTA index {index}: {line}")
+                sys.exit(2)
+            contigs.append(Contig(fields[0], fields[2], int(fields[1])))
+    return contigs
+
+
+def load_contigs(index=None, fasta=None):
+    """
+    Returns the contigs of an assembly from its index, scanning the FASTA
+    file itself if no index is given.
+    """
+    if index:
+        return read_index(index)
+    return list(scan_fasta(fasta))
+
+
+def get_description_to_id(contigs):
+    description_to_id = {contig.description: contig.id for contig in contigs}
+    logger.debug(f"Fasta header to identifier is: {description_to_id}")
+    return description_to_id
+
+
+def add_contig_arguments(parser):
+    """
+    Adds the mutually exclusive --index/--fasta options to a script's parser.
+    """
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument(
+        "--index",
+        "-x",
+        help="Path to the contig index of the fasta file being analyzed",
+        type=os.path.abspath,
+    )
+    group.add_argument(
+        "--fasta",
+        "-f",
+        help="Path to fasta file being analyzed",
+        type=os.path.abspath,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Index the identifier, header and length of every contig "
+        "of a fasta file.")
+    parser.add_argument(
+        "--fasta",
+        "-f",
+        help="[REQUIRED] Path to fasta file to index, may be gzip compressed",
+        type=os.path.abspath,
+        required=True,
+    )
+    parser.add_argument(
+        "--output",
+        "-o",
+        help="[REQUIRED] Path to the output index",
+        type=os.path.abspath,
+        required=True,
+    )
+    args = parser.parse_args()
+
+    write_index(scan_fasta(args.fasta), args.output)
+    logger.success(f"Completed indexing {args.fasta}")
+
+
+if __name__ == "__main__":
+    main()
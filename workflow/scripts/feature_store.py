@@ -0,0 +1,376 @@
+#!/usr/bin/env python
+"""
+A cohort-wide store of the normalized tool features of every assembly, kept
+in SQLite with an R*Tree over the feature coordinates. The store is loaded
+incrementally from the annotation indexes under the intermediate directory
+and answers interval and attribute queries across all assemblies at once.
+"""
+
+import argparse
+import glob
+import itertools
+import json
+import os
+import sqlite3
+import sys
+from loguru import logger
+
+from intervals import Interval, index_by_chrom
+from mobileelementfinder_analysis import label_mobileelementfinder
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS assemblies (
+    id INTEGER PRIMARY KEY,
+    key TEXT UNIQUE NOT NULL,
+    path TEXT NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS contigs (
+    id INTEGER PRIMARY KEY,
+    assembly INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    description TEXT,
+    length INTEGER,
+    plasmid TEXT,
+    mobility TEXT
+);
+CREATE INDEX IF NOT EXISTS contigs_by_assembly ON contigs (assembly);
+CREATE INDEX IF NOT EXISTS contigs_by_name ON contigs (name);
+CREATE INDEX IF NOT EXISTS contigs_by_description ON contigs (description);
+CREATE TABLE IF NOT EXISTS features (
+    id INTEGER PRIMARY KEY,
+    contig INTEGER NOT NULL,
+    tool TEXT NOT NULL,
+    start INTEGER NOT NULL,
+    end INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    fields TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS features_by_contig ON features (contig);
+CREATE INDEX IF NOT EXISTS features_by_name ON features (tool, name);
+-- one dimension holds the contig and the other the coordinates, so that a
+-- window on a contig is a single box
+CREATE VIRTUAL TABLE IF NOT EXISTS feature_boxes USING rtree_i32 (
+    id, contig_min, contig_max, start, end
+);
+"""
+
+# the columns printed by the features command
+FEATURE_COLUMNS = [
+    "#assembly", "tool", "contig", "start", "end", "annotation",
+    "contig_length", "plasmid", "mobility"
+]
+
+
+def connect(path):
+    conn = sqlite3.connect(path)
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def iter_indexes(intermediate_dir):
+    """
+    Yields the key and path of every annotation index, keyed like the cost
+    model by batch, sequence and sample.
+    """
+    pattern = os.path.join(intermediate_dir, "*", "annotation_index",
+                           "sequence_*", "*.json")
+    for path in sorted(glob.glob(pattern)):
+        batch, _, sequence, filename = path.split(os.sep)[-4:]
+        yield f"{batch}/{sequence}/{filename[:-len('.json')]}", path
+
+
+def delete_assembly(conn, assembly_id):
+    contig_ids = "SELECT id FROM contigs WHERE assembly = ?"
+    conn.execute(
+        "DELETE FROM feature_boxes WHERE id IN (SELECT id FROM features "
+        f"WHERE contig IN ({contig_ids}))", (assembly_id, ))
+    conn.execute(f"DELETE FROM features WHERE contig IN ({contig_ids})",
+                 (assembly_id, ))
+    conn.execute("DELETE FROM contigs WHERE assembly = ?", (assembly_id, ))
+    conn.execute("DELETE FROM assemblies WHERE id = ?", (assembly_id, ))
+
+
+def insert_assembly(conn, key, path, stat, index):
+    """
+    Adds the contigs and features of one annotation index. The plasmid
+    contigs of mob_recon become features spanning their whole contig.
+    """
+    assembly_id = conn.execute(
+        "INSERT INTO assemblies (key, path, mtime_ns, size) "
+        "VALUES (?, ?, ?, ?)",
+        (key, path, stat.st_mtime_ns, stat.st_size)).lastrowid
+    contig_ids = {}
+    features = []
+    for name, length, description in index["contigs"]:
+        plasmid, mobility = index["plasmids"].get(name, (None, None))
+        contig_ids[name] = conn.execute(
+            "INSERT INTO contigs (assembly, name, description, length, "
+            "plasmid, mobility) VALUES (?, ?, ?, ?, ?, ?)",
+            (assembly_id, name, description, length, plasmid,
+             mobility)).lastrowid
+        if plasmid is not None:
+            features.append(("mob_suite", name, 0, length, [plasmid,
+                                                            mobility]))
+    for tool, tool_features in index["features"].items():
+        for chrom, start, end, fields in tool_features:
+            features.append((tool, chrom, start, end, fields))
+
+    next_id = conn.execute(
+        "SELECT COALESCE(MAX(id), 0) + 1 FROM features").fetchone()[0]
+    rows = []
+    boxes = []
+    for feature_id, (tool, chrom, start, end,
+                     fields) in enumerate(features, start=next_id):
+        if chrom not in contig_ids:
+            # tools may report contigs missing from the fasta index
+            contig_ids[chrom] = conn.execute(
+                "INSERT INTO contigs (assembly, name) VALUES (?, ?)",
+                (assembly_id, chrom)).lastrowid
+        contig_id = contig_ids[chrom]
+        name = fields[0] if fields else ""
+        rows.append((feature_id, contig_id, tool, start, end, name,
+                     json.dumps(fields)))
+        boxes.append((feature_id, contig_id, contig_id, start, end))
+    conn.executemany("INSERT INTO features VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+    conn.executemany("INSERT INTO feature_boxes VALUES (?, ?, ?, ?, ?)", boxes)
+    return len(rows)
+
+
+def load_store(conn, intermediate_dir):
+    """
+    Adds the annotation indexes that are new or changed since the last load
+    and drops the assemblies whose index is gone.
+    """
+    loaded = unchanged = features = 0
+    with conn:
+        for key, path in iter_indexes(intermediate_dir):
+            stat = os.stat(path)
+            row = conn.execute(
+                "SELECT id, mtime_ns, size FROM assemblies WHERE key = ?",
+                (key, )).fetchone()
+            if row is not None:
+                if row[1:] == (stat.st_mtime_ns, stat.st_size):
+                    unchanged += 1
+                    continue
+                delete_assembly(conn, row[0])
+            with open(path, "r") as f:
+                index = json.load(f)
+            features += insert_assembly(conn, key, path, stat, index)
+            loaded += 1
+        removed = 0
+        for assembly_id, path in conn.execute(
+                "SELECT id, path FROM assemblies").fetchall():
+            if not os.path.exists(path):
+                delete_assembly(conn, assembly_id)
+                removed += 1
+    logger.info(f"Loaded {loaded} assemblies with {features} features, "
+                f"kept {unchanged} unchanged and removed {removed}")
+
+
+def query_features(conn,
+                   tool=None,
+                   name=None,
+                   assembly=None,
+                   contig=None,
+                   start=None,
+                   end=None,
+                   window=0,
+                   contig_class=None):
+    """
+    Returns the features matching every given filter, sorted by assembly
+    and position. With a contig, by identifier or fasta header, and a start
+    and end, only the features overlapping the region widened by `window` bp
+    are returned.
+    """
+    columns = ("SELECT assemblies.key, features.tool, contigs.name, "
+               "features.start, features.end, features.fields, "
+               "contigs.length, contigs.plasmid, contigs.mobility")
+    conditions = []
+    params = []
+    if contig is not None:
+        # look the contigs up by name, then their features up in the R*Tree;
+        # CROSS JOIN keeps SQLite from choosing another order
+        query = (f"{columns} FROM contigs CROSS JOIN feature_boxes "
+                 "CROSS JOIN features JOIN assemblies "
+                 "ON contigs.assembly = assemblies.id")
+        conditions += [
+            "(contigs.name = ? OR contigs.description = ?)",
+            "feature_boxes.contig_min = contigs.id", "feature_boxes.start < ?",
+            "feature_boxes.end > ?", "features.id = feature_boxes.id"
+        ]
+        params += [contig, contig, end + window, start - window]
+    else:
+        query = (f"{columns} FROM features JOIN contigs "
+                 "ON features.contig = contigs.id JOIN assemblies "
+                 "ON contigs.assembly = assemblies.id")
+    if tool:
+        conditions.append("features.tool = ?")
+        params.append(tool)
+    if name:
+        conditions.append("features.name GLOB ?")
+        params.append(name)
+    if assembly:
+        conditions.append("assemblies.key GLOB ?")
+        params.append(assembly)
+    if contig_class == "plasmid":
+        conditions.append("contigs.plasmid IS NOT NULL")
+    elif contig_class == "chromosome":
+        conditions.append("contigs.plasmid IS NULL")
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += (" ORDER BY assemblies.key, contigs.name, features.start, "
+              "features.end, features.tool")
+    return conn.execute(query, params).fetchall()
+
+
+def query_mge_context(conn, contig, start, end, maxdist, assembly=None):
+    """
+    Yields the assembly and label of every assembly where the region
+    overlaps an IS element or lies between two IS elements of the same type
+    within maxdist bp, classified like mobileelementfinder_analysis.
+    """
+    # the closest elements on either side within maxdist are all in the
+    # window, so they are the closest elements of the whole contig too
+    rows = query_features(conn,
+                          tool="mobileelementfinder",
+                          assembly=assembly,
+                          contig=contig,
+                          start=start,
+                          end=end,
+                          window=maxdist + 1)
+    for (key, contig_name), contig_rows in itertools.groupby(
+            rows, key=lambda row: row[:3:2]):
+        elements = [
+            Interval(contig_name, row[3], row[4], json.loads(row[5]))
+            for row in contig_rows
+        ]
+        region = Interval(contig_name, start, end, ["region"])
+        for labelled in label_mobileelementfinder([region],
+                                                  index_by_chrom(elements),
+                                                  maxdist):
+            yield key, labelled.name.split("|", 1)[1]
+
+
+def format_feature(key, tool, contig, start, end, fields, length, plasmid,
+                   mobility):
+    return "\t".join([
+        key, tool, contig,
+        str(start),
+        str(end), "|".join(json.loads(fields)).rstrip("|"),
+        "" if length is None else str(length), plasmid or "", mobility or ""
+    ])
+
+
+def add_region_arguments(parser, required):
+    parser.add_argument("--contig",
+                        help="Contig of the region, by identifier or fasta "
+                        "header",
+                        required=required)
+    parser.add_argument("--start",
+                        help="Start of the region",
+                        type=int,
+                        required=required)
+    parser.add_argument("--end",
+                        help="End of the region",
+                        type=int,
+                        required=required)
+    parser.add_argument("--assembly",
+                        help="Only query the assemblies whose "
+                        "batch/sequence_N/sample key matches this glob")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Load the annotation indexes of every assembly into a "
+        "single indexed store, and query the tool features of the whole "
+        "cohort by region or by attribute.")
+    parser.add_argument(
+        "--store",
+        "-s",
+        help="[REQUIRED] Path to the feature store, an SQLite database",
+        required=True,
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    load = subparsers.add_parser(
+        "load",
+        help="Add the annotation indexes that are new or changed since the "
+        "last load")
+    load.add_argument(
+        "--intermediate_dir",
+        help="Directory of the intermediate files. Default is intermediate",
+        default="intermediate",
+    )
+
+    features = subparsers.add_parser(
+        "features", help="Print the features matching every given filter")
+    add_region_arguments(features, required=False)
+    features.add_argument("--window",
+                          help="Widen the region by this many bp on each "
+                          "side. Default is 0",
+                          type=int,
+                          default=0)
+    features.add_argument(
+        "--tool",
+        help="Only print the features of this tool",
+        choices=[
+            "integronfinder", "plasmidfinder", "mob_suite", "phigaro",
+            "mobileelementfinder"
+        ],
+    )
+    features.add_argument(
+        "--name",
+        help="Only print the features whose name, like the replicon, IS "
+        "element or integron type, matches this glob")
+    features.add_argument(
+        "--contig_class",
+        help="Only print the features on contigs mob_recon placed on a "
+        "plasmid, or on the others",
+        choices=["plasmid", "chromosome"],
+    )
+
+    mge = subparsers.add_parser(
+        "mge_context",
+        help="Print the assemblies where a region overlaps an IS element or "
+        "lies between two IS elements of the same type")
+    add_region_arguments(mge, required=True)
+    mge.add_argument(
+        "--maxdist",
+        help="Max. dist. to consider as mobile when sandwiched between two "
+        "MGEs of the same type. Default is 10000",
+        type=int,
+        default=10000)
+    args = parser.parse_args()
+
+    conn = connect(args.store)
+    if args.command == "load":
+        load_store(conn, args.intermediate_dir)
+        logger.success(f"Updated the feature store {args.store}")
+    elif args.command == "features":
+        region = [args.contig, args.start, args.end]
+        if any(value is not None for value in region) and None in region:
+            logger.error("--contig, --start and --end must be given together")
+            sys.exit(2)
+        rows = query_features(conn,
+                              tool=args.tool,
+                              name=args.name,
+                              assembly=args.assembly,
+                              contig=args.contig,
+                              start=args.start,
+                              end=args.end,
+                              window=args.window,
+                              contig_class=args.contig_class)
+        print("\t".join(FEATURE_COLUMNS))
+        for row in rows:
+            print(format_feature(*row))
+    else:
+        print("#assembly\tlabel")
+        for key, label in query_mge_context(conn, args.contig, args.start,
+                                            args.end, args.maxdist,
+                                            args.assembly):
+            print(f"{key}\t{label}")
+
+
+if __name__ == "__main__":
+    main()
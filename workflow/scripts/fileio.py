@@ -0,0 +1,18 @@
+import gzip
+
+GZIP_MAGIC = b"\x1f\x8b"
+
+
+def is_gzipped(path):
+    with open(path, "rb") as f:
+        return f.read(2) == GZIP_MAGIC
+
+
+def open_text(path):
+    """
+    Opens a plain, gzip or bgzip compressed text file for reading. The file
+    is decompressed on the fly in a single pass.
+    """
+    if is_gzipped(path):
+        return gzip.open(path, "rt")
+    return open(path, "r")
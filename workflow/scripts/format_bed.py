@@ -1,59 +1,69 @@
 #!/usr/bin/env python
 
 import argparse
-import subprocess
 import os
 import sys
 from loguru import logger
-from Bio import SeqIO
 
+from fasta_index import (add_contig_arguments, get_description_to_id,
+                         load_contigs)
+from intervals import (SORTED_BED_HEADER, Interval, add_bed_format_argument,
+                       iter_bed_lines, sort_key, use_binary_beds, write_bed)
 
-def check_input(input_fasta, input_bed, output_bed):
-    fasta_sequences = SeqIO.parse(open(input_fasta), "fasta")
 
-    # define a dictionary of chromosome keys and values
-    description_to_id = {}
-    for i in fasta_sequences:
-        description_to_id[i.description] = i.id
-    logger.debug(f"Fasta header to identifier is: {description_to_id}")
+def clean_regions(description_to_id, input_bed):
+    """
+    Returns the regions of the input BED on contig identifiers, deduplicated
+    and sorted like sort-bed, breaking ties on the remaining columns.
+    """
+    regions = []
+    seen = set()
+    # loop through each line in the input BED file, text or binary
+    for line in iter_bed_lines(input_bed):
+        if line.startswith("#") or line.strip() == "":
+            continue
+        # split the line into columns
+        fields = line.rstrip().split("\t")
+        if len(fields) != 4:
+            logger.error(fields)
+            logger.error(
+                f"Number of columns is {len(fields)}! This is not 4! Please make it 4 columns!"
+            )
+
+        fields = [item.strip() for item in fields]
+        # check if the chromosome in the line matches a key in the dictionary
+        if fields[0] in description_to_id:
+            # if there is a match, replace the chromosome value with the dictionary value
+            fields[0] = description_to_id[fields[0]]
 
-    # exit = False
-    # open the input BED file for reading
-    with open(input_bed, "r") as input_file:
-        # open the output BED file for writing
-        with open(output_bed, "w") as output_file:
-            # loop through each line in the input BED file
-            for line in input_file:
-                # split the line into columns
-                fields = line.rstrip().split("\t")
-                if len(fields) != 4:
-                    logger.error(fields)
-                    logger.error(
-                        f"Number of columns is {len(fields)}! This is not 4! Please make it 4 columns!"
-                    )
-                    exit = True
+        try:
+            start, end = int(fields[1]), int(fields[2])
+        except (IndexError, ValueError):
+            logger.error(f"Invalid coordinates in {input_bed}: {fields}")
+            sys.exit(2)
+        if start > end:
+            logger.warning(f"{start} is greater than {end}. Switching these")
+            start, end = end, start
 
-                fields = [item.strip() for item in fields]
-                # check if the chromosome in the line matches a key in the dictionary
-                if fields[0] in description_to_id:
-                    # exit = True
-                    # logger.error(
-                    # f"{fields[0]} found in bed file! Please use {description_to_id[fields[0]]} instead! Reformatted bedfile outputted here {output_bed}. Please rerun callmemobile with that bed file instead!"
-                    # )
-                    # if there is a match, replace the chromosome value with the dictionary value
-                    fields[0] = description_to_id[fields[0]]
+        region = Interval(fields[0], start, end, fields[3:])
+        # drop regions listed more than once
+        if region.to_line() in seen:
+            logger.warning(f"Dropping duplicate region {fields}")
+            continue
+        seen.add(region.to_line())
+        regions.append(region)
 
-                if int(fields[1]) > int(fields[2]):
-                    logger.warning(
-                        f"{fields[1]} is greater than {fields[2]}. Switching these"
-                    )
-                    start = fields[2]
-                    end = fields[1]
-                    fields[1] = start
-                    fields[2] = end
+    regions.sort(key=lambda region: (sort_key(region), region.fields))
+    return regions
 
-                # write the updated line to the output BED file
-                output_file.write("\t".join(fields) + "\n")
+
+def check_input(contigs, input_bed, output_bed):
+    # define a dictionary of chromosome keys and values
+    description_to_id = get_description_to_id(contigs)
+    regions = clean_regions(description_to_id, input_bed)
+    # record the order in the header so that downstream steps can skip their
+    # own sorting
+    write_bed(regions, output_bed, SORTED_BED_HEADER if regions else None)
     return description_to_id
 
 
@@ -62,17 +72,11 @@ def main():
     parser.add_argument(
         "--input",
         "-i",
-        help="[REQUIRED] Path to input bed file",
-        type=os.path.abspath,
-        required=True,
-    )
-    parser.add_argument(
-        "--fasta",
-        "-f",
-        help="[REQUIRED] Path to fasta file being analyzed",
+        help="[REQUIRED] Path to input bed file, may be gzip compressed",
         type=os.path.abspath,
         required=True,
     )
+    add_contig_arguments(parser)
     parser.add_argument(
         "--output",
         "-o",
@@ -80,9 +84,12 @@ def main():
         type=os.path.abspath,
         required=True,
     )
+    add_bed_format_argument(parser)
     args = parser.parse_args()
+    use_binary_beds(args.binary_bed)
 
-    description_to_id = check_input(args.fasta, args.input, args.output)
+    contigs = load_contigs(args.index, args.fasta)
+    description_to_id = check_input(contigs, args.input, args.output)
     logger.success("Completed reformatting")
 
 
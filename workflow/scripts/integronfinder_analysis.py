@@ -1,63 +1,103 @@
 #!/usr/bin/env python
 
 import argparse
+import glob
 from loguru import logger
 import os
-import subprocess
 import sys
 
+from intervals import (Interval, add_bed_format_argument, index_by_chrom,
+                       read_bed, sort_intervals, use_binary_beds, write_bed)
+
+
+def iter_integrons(integrons_file):
+    """
+    Yields the replicon, start, end and integron type of every element in an
+    IntegronFinder `.integrons` table, clamping negative starts to 0.
+    """
+    with open(integrons_file, "r") as f:
+        for line in f:
+            if line.startswith("#") or "ID_integron" in line:
+                continue
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) < 11:
+                if line.strip():
+                    logger.error(
+                        f"Invalid line in {integrons_file}: {line.strip()}")
+                    sys.exit(2)
+                continue
+            yield Interval(fields[1], max(int(fields[3]), 0), int(fields[4]),
+                           [fields[10]])
+
+
+def read_integronfinderout(integronfinder_outdir):
+    """
+    Returns the sorted elements of every `.integrons` table in IntegronFinder's
+    output directory.
+    """
+    integron_outputs = sorted(
+        glob.glob(os.path.join(integronfinder_outdir, "*.integrons")))
+    # the integron_finder rule only touches the summary of empty assemblies
+    if not integron_outputs:
+        logger.warning(
+            f"No Integron Finder results (*.integrons) in {integronfinder_outdir}"
+        )
+        return []
+    integrons = [
+        integron for integrons_file in integron_outputs
+        for integron in iter_integrons(integrons_file)
+    ]
+    return sort_intervals(integrons)
+
 
 def format_integronfinderout(integronfinder_outdir, analysis_outdir):
-    integron_outputs = os.path.join(integronfinder_outdir, "*.integrons")
     allintegrons = os.path.join(analysis_outdir,
                                 "integronfinder_out.sorted.bed")
-    with open(os.path.join(f"{allintegrons}"), 'w') as f:
-        output = subprocess.run([
-            f"sed 1d {integron_outputs} \
-                | grep -v '^#' \
-                | grep -v 'ID_integron' \
-                | cut -f 2,4,5,11 \
-                | awk '{{$2=($2<0)?0:$2; print}}' \
-                | sort-bed -"
-        ],
-                                shell=True,
-                                stdout=f)
-        if output.returncode != 0:
-            logger.error(
-                "Error in formatting Integron Finder output as bedfile!")
-            logger.error(output)
-            logger.error(output.stdout.decode())
-            logger.error(output.stderr.decode())
-            sys.exit(2)
-        else:
-            logger.success(
-                f"Completed reformatting Integron Finder output to {allintegrons}"
-            )
-            return allintegrons
-
-
-def classify_integronfinder(input_bed, integron_bed, output_dir, bedolap):
+    write_bed(read_integronfinderout(integronfinder_outdir), allintegrons)
+    logger.success(
+        f"Completed reformatting Integron Finder output to {allintegrons}")
+    return allintegrons
+
+
+def label_integronfinder(regions, integrons, bedolap):
+    """
+    Yields every region holding integron elements, its last column labelled
+    with their types. `integrons` indexes the elements by contig.
+    """
+    for region in regions:
+        contig_integrons = integrons.get(region.chrom)
+        if contig_integrons is None:
+            continue
+        # an integron element maps to the region when the overlap covers
+        # at least `bedolap` of the element's own length
+        types = {
+            integron.name
+            for integron in contig_integrons.map_fraction(
+                region.start, region.end, fraction_map=bedolap)
+        }
+        if types:
+            label = ";".join(sorted(types))
+            if region.fields:
+                fields = region.fields[:-1] + [f"{region.fields[-1]}|{label}"]
+            else:
+                fields = [label]
+            yield Interval(region.chrom, region.start, region.end, fields)
+
+
+def classify_integronfinder(input_bed,
+                            integron_bed,
+                            output_dir,
+                            bedolap,
+                            regions=None):
     output_bed = os.path.join(output_dir,
                               "input-ifinder_out-intersect.sorted.bed")
     logger.info(
         f"Classifying IntegronFinder results. Need {bedolap} overlap of gene regions w/ input regions to classify."
     )
-    output = subprocess.run(
-        # [
-        # f"bedmap --echo --echo-map-id-uniq --fraction-ref {bedolap} {integron_bed} {input_bed} \
-        # | grep -v '|\s*$'"
-        # ],
-        [
-            f"bedmap --echo --echo-map-id-uniq --fraction-map {bedolap} {input_bed} {integron_bed} \
-            | grep -v '|\\s*$'"
-        ],
-        capture_output=True,
-        shell=True,
-    )
-    logger.debug(output)
-    with open(f"{output_bed}", "w") as f:
-        f.write(str(output.stdout.decode()))
-    logger.debug(output.stderr.decode())
+    integrons = index_by_chrom(read_bed(integron_bed))
+    if regions is None:
+        regions = read_bed(input_bed)
+    write_bed(label_integronfinder(regions, integrons, bedolap), output_bed)
     logger.success("Completed classifying Integron Finder output")
     return output_bed
 
@@ -95,7 +135,9 @@ def main():
         default="./maybemobile_out/",
         required=False,
     )
+    add_bed_format_argument(parser)
     args = parser.parse_args()
+    use_binary_beds(args.binary_bed)
     integron_bedformat = format_integronfinderout(args.input, args.output)
     classify_integronfinder(args.bed, integron_bedformat, args.output,
                             args.overlap)
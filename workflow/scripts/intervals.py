@@ -0,0 +1,348 @@
+import bisect
+import heapq
+from array import array
+
+from binary_bed import BinaryBed, is_binary_bed, write_binary_bed
+from fileio import open_text
+
+# first line of the cleaned BEDs written by format_bed.py, whose regions are
+# deduplicated and sorted like sort-bed sorts them
+SORTED_BED_HEADER = "##callmemobile-cleaned-bed sorted=true"
+
+# whether write_bed writes the binary format of binary_bed.py instead of
+# text; readers detect either format
+BINARY_BEDS = False
+
+
+def use_binary_beds(enabled=True):
+    global BINARY_BEDS
+    BINARY_BEDS = enabled
+
+
+def add_bed_format_argument(parser):
+    """
+    Adds the --binary_bed option to a script writing BED files.
+    """
+    parser.add_argument(
+        "--binary_bed",
+        help="Write BED files in the binary columnar format of binary_bed.py "
+        "instead of text. Either format is read",
+        action="store_true",
+    )
+
+
+class Interval:
+    """
+    A BED record: `fields` holds every column after the end coordinate.
+    """
+    __slots__ = ("chrom", "start", "end", "fields")
+
+    def __init__(self, chrom, start, end, fields=None):
+        self.chrom = chrom
+        self.start = start
+        self.end = end
+        self.fields = fields if fields is not None else []
+
+    @property
+    def name(self):
+        return self.fields[0] if self.fields else ""
+
+    def to_line(self):
+        return "\t".join(
+            [self.chrom, str(self.start),
+             str(self.end)] + self.fields) + "\n"
+
+
+def iter_binary_bed(bed_file_path):
+    with BinaryBed(bed_file_path) as bed:
+        for chrom, start, end, fields in bed.rows():
+            yield Interval(chrom, start, end, fields)
+
+
+def read_bed(bed_file_path):
+    """
+    Reads a BED file, skipping comments and blank lines.
+    """
+    if is_binary_bed(bed_file_path):
+        return list(iter_binary_bed(bed_file_path))
+    intervals = []
+    with open_text(bed_file_path) as f:
+        for line in f:
+            if line.startswith("#") or line.strip() == "":
+                continue
+            fields = line.rstrip("\n").split("\t")
+            intervals.append(
+                Interval(fields[0], int(fields[1]), int(fields[2]),
+                         fields[3:]))
+    return intervals
+
+
+def is_sorted_bed(bed_file_path):
+    """
+    True if the BED file carries the header of a sorted, deduplicated BED.
+    """
+    if is_binary_bed(bed_file_path):
+        with BinaryBed(bed_file_path) as bed:
+            return bed.header == SORTED_BED_HEADER
+    with open_text(bed_file_path) as f:
+        return f.readline().rstrip("\n") == SORTED_BED_HEADER
+
+
+def iter_bed_lines(bed_file_path):
+    """
+    Yields the lines of a BED file, or the text lines of a binary one.
+    """
+    if is_binary_bed(bed_file_path):
+        with BinaryBed(bed_file_path) as bed:
+            header = bed.header
+        if header is not None:
+            yield header + "\n"
+        for interval in iter_binary_bed(bed_file_path):
+            yield interval.to_line()
+        return
+    with open_text(bed_file_path) as f:
+        yield from f
+
+
+def write_bed(intervals, output_bed, header=None):
+    if BINARY_BEDS:
+        write_binary_bed(
+            ((interval.chrom, interval.start, interval.end, interval.fields)
+             for interval in intervals), output_bed, header)
+        return
+    with open(output_bed, "w") as f:
+        if header is not None:
+            f.write(header + "\n")
+        f.writelines(interval.to_line() for interval in intervals)
+
+
+def sort_key(interval):
+    # the order of sort-bed: chromosome, then start, then end
+    return (interval.chrom, interval.start, interval.end)
+
+
+def sort_intervals(intervals, presorted=False):
+    """
+    Sorts intervals like sort-bed. Intervals derived in order from a sorted
+    BED are only copied.
+    """
+    if presorted:
+        return list(intervals)
+    return sorted(intervals, key=sort_key)
+
+
+def merge_sorted(*sorted_intervals):
+    """
+    Merges already sorted sequences of intervals in a single linear pass.
+    Ties keep the order of the sequences.
+    """
+    return heapq.merge(*sorted_intervals, key=sort_key)
+
+
+def group_by_chrom(intervals):
+    """
+    Buckets intervals by chromosome, keeping their order within each bucket.
+    """
+    by_chrom = {}
+    for interval in intervals:
+        by_chrom.setdefault(interval.chrom, []).append(interval)
+    return by_chrom
+
+
+def overlap_length(start_a, end_a, start_b, end_b):
+    return min(end_a, end_b) - max(start_a, start_b)
+
+
+class ContigFeatures:
+    """
+    The features of one contig, kept sorted by start and by end in compact
+    arrays. Overlapping features are found in an implicit interval tree over
+    the features sorted by start, like cgranges, in O(log N + hits) time
+    whatever their lengths; upstream and downstream features by bisection.
+    """
+    __slots__ = ("features", "starts", "ends", "subtree_ends", "levels",
+                 "orders", "by_end", "sorted_ends")
+
+    def __init__(self, features):
+        features = list(features)
+        order = sorted(range(len(features)),
+                       key=lambda i: (features[i].start, features[i].end))
+        self.features = [features[i] for i in order]
+        self.orders = array("q", order)
+        self.starts = array("q", (f.start for f in self.features))
+        self.ends = array("q", (f.end for f in self.features))
+        self.subtree_ends, self.levels = self._build_tree()
+        self.by_end = sorted(features, key=lambda f: (f.end, f.start))
+        self.sorted_ends = array("q", (f.end for f in self.by_end))
+
+    def __len__(self):
+        return len(self.features)
+
+    def _build_tree(self):
+        """
+        Node i of the implicit tree sits at the level of its number of
+        trailing 1 bits; a node at level k covers the features from
+        i - 2**k + 1 to i + 2**k - 1 and records the largest end among them.
+        """
+        n = len(self.ends)
+        subtree_ends = array("q", self.ends)
+        if n == 0:
+            return subtree_ends, -1
+        # the largest end of the incomplete subtree on the right edge
+        last_i, last = 0, 0
+        for i in range(0, n, 2):
+            last_i, last = i, self.ends[i]
+        k = 1
+        while 1 << k <= n:
+            x = 1 << (k - 1)
+            for i in range((x << 1) - 1, n, x << 2):
+                right = subtree_ends[i + x] if i + x < n else last
+                subtree_ends[i] = max(self.ends[i], subtree_ends[i - x], right)
+            # move to the parent of the node on the right edge
+            if not last_i >> k & 1:
+                last_i -= x
+            if last_i < n and subtree_ends[last_i] > last:
+                last = subtree_ends[last_i]
+            k += 1
+        return subtree_ends, k - 1
+
+    def _overlapping_indexes(self, start, end):
+        # in-order walk of the subtrees whose largest end is after `start`,
+        # stopping at the features starting at or after `end`
+        n = len(self.starts)
+        starts, ends, subtree_ends = self.starts, self.ends, self.subtree_ends
+        hits = []
+        if n == 0:
+            return hits
+        stack = [((1 << self.levels) - 1, self.levels, False)]
+        while stack:
+            x, k, visited = stack.pop()
+            if k <= 3:
+                # small subtrees are scanned
+                i0 = x >> k << k
+                for i in range(i0, min(i0 + (1 << (k + 1)) - 1, n)):
+                    if starts[i] >= end:
+                        break
+                    if ends[i] > start:
+                        hits.append(i)
+            elif not visited:
+                # the left subtree first, then the node and its right subtree
+                stack.append((x, k, True))
+                left = x - (1 << (k - 1))
+                if left >= n or subtree_ends[left] > start:
+                    stack.append((left, k - 1, False))
+            elif x < n and starts[x] < end:
+                if ends[x] > start:
+                    hits.append(x)
+                right = x + (1 << (k - 1))
+                if right >= n or subtree_ends[right] > start:
+                    stack.append((right, k - 1, False))
+        return hits
+
+    def overlapping(self, start, end, input_order=False):
+        """
+        The features overlapping [start, end), sorted by position or, with
+        `input_order`, in the order they were given.
+        """
+        hits = self._overlapping_indexes(start, end)
+        return self._features(hits, input_order)
+
+    def _features(self, hits, input_order):
+        if input_order:
+            hits.sort(key=self.orders.__getitem__)
+        return [self.features[i] for i in hits]
+
+    def sweep(self, regions, input_order=False):
+        """
+        Yields the features overlapping each of `regions`, which must be
+        sorted by start. The features that started before the current region
+        are kept in a heap by end and dropped once they end at or before its
+        start, so the pass costs O((N + M) log N + hits).
+        """
+        # (end, index) of the features starting before the current region
+        active = []
+        next_i = 0
+        n = len(self.features)
+        for region in regions:
+            while next_i < n and self.starts[next_i] < region.start:
+                heapq.heappush(active, (self.ends[next_i], next_i))
+                next_i += 1
+            while active and active[0][0] <= region.start:
+                heapq.heappop(active)
+            # the active features all overlap the region, the later ones do
+            # when they start before its end
+            hits = sorted(i for _, i in active)
+            i = next_i
+            while i < n and self.starts[i] < region.end:
+                if self.ends[i] > region.start:
+                    hits.append(i)
+                i += 1
+            yield self._features(hits, input_order)
+
+    def map_fraction(self, start, end, fraction_ref=None, fraction_map=None):
+        """
+        The features overlapping [start, end) by at least `fraction_ref` of
+        the query's length and `fraction_map` of their own length, like
+        bedmap's --fraction-ref and --fraction-map.
+        """
+        hits = []
+        for feature in self.overlapping(start, end):
+            overlap = overlap_length(start, end, feature.start, feature.end)
+            ref_length = end - start
+            map_length = feature.end - feature.start
+            if fraction_ref is not None and overlap < fraction_ref * ref_length:
+                continue
+            if fraction_map is not None and overlap < fraction_map * map_length:
+                continue
+            hits.append(feature)
+        return hits
+
+    def window(self, start, end, distance):
+        """
+        The features within `distance` bp of [start, end), like bedmap's
+        --range.
+        """
+        return self.overlapping(start - distance, end + distance)
+
+    def upstream(self, start):
+        """
+        The non-overlapping feature ending closest before `start`, and its
+        (negative) distance.
+        """
+        i = bisect.bisect_right(self.sorted_ends, start)
+        if i == 0:
+            return None, None
+        feature = self.by_end[i - 1]
+        return feature, feature.end - start
+
+    def downstream(self, end):
+        """
+        The non-overlapping feature starting closest after `end`, and its
+        distance.
+        """
+        i = bisect.bisect_left(self.starts, end)
+        if i == len(self.starts):
+            return None, None
+        feature = self.features[i]
+        return feature, feature.start - end
+
+    def closest(self, start, end):
+        """
+        The closest feature to [start, end) on either side, and its signed
+        distance. Overlapping features are at distance 0.
+        """
+        overlaps = self.overlapping(start, end)
+        if overlaps:
+            return overlaps[0], 0
+        up, up_dist = self.upstream(start)
+        down, down_dist = self.downstream(end)
+        if down is None or (up is not None and -up_dist <= down_dist):
+            return up, up_dist
+        return down, down_dist
+
+
+def index_by_chrom(intervals):
+    return {
+        chrom: ContigFeatures(features)
+        for chrom, features in group_by_chrom(intervals).items()
+    }
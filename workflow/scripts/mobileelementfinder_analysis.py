@@ -1,63 +1,100 @@
 #!/usr/bin/env python
 
 import argparse
+import csv
 from loguru import logger
 import os
-import subprocess
-from Bio import SeqIO
 import sys
 
-
-def read_fa(input_fasta):
-    fasta_sequences = SeqIO.parse(open(input_fasta), "fasta")
-
-    # define a dictionary of chromosome keys and values
-    description_to_id = {}
-    for i in fasta_sequences:
-        description_to_id[i.description] = i.id
-    logger.debug(f"Fasta header to identifier is: {description_to_id}")
-    return description_to_id
+from fasta_index import (add_contig_arguments, get_description_to_id,
+                         load_contigs)
+from intervals import (Interval, add_bed_format_argument, index_by_chrom,
+                       is_sorted_bed, merge_sorted, read_bed, sort_intervals,
+                       use_binary_beds, write_bed)
+
+
+def iter_mge_results(mge_outputcsv, description_to_id):
+    """
+    Yields the contig, start, end, name and type of every element in
+    MobileElementFinder's results, skipping its leading comment lines.
+    """
+    columns = ["contig", "start", "end", "name", "type"]
+    with open(mge_outputcsv, "r", newline="") as f:
+        reader = csv.DictReader(line for line in f if not line.startswith("#"))
+        missing = [
+            column for column in columns
+            if column not in (reader.fieldnames or [])
+        ]
+        if reader.fieldnames and missing:
+            logger.error(
+                f"Columns {missing} not found in mge output {mge_outputcsv}")
+            sys.exit(2)
+        for row in reader:
+            mge_id = row["contig"]
+            yield Interval(description_to_id.get(mge_id, mge_id),
+                           int(row["start"]), int(row["end"]),
+                           [row["name"], row["type"]])
 
 
 def bedformat_mobileelementfinder(mge_outputcsv, analysis_outputdir,
                                   description_to_id):
     mge_outputbed = os.path.join(analysis_outputdir, "mge_out.sorted.bed")
-    output = subprocess.run(
-        [
-            f"grep -v '^#' {mge_outputcsv} \
-            | csvtk cut -f contig,start,end,name,type -T \
-            | sed 1d"
-        ],
-        capture_output=True,
-        shell=True,
-    )
-    if output.returncode != 0:
-        logger.error("Error in formatting mge output as bedfile!")
-        logger.error(output.stdout.decode())
-        logger.error(output.stderr.decode())
-        sys.exit(2)
-    else:
-        with open(f"{mge_outputbed}.unsorted", "w") as f:
-            for lines in output.stdout.decode().split("\n"):
-                linelist = lines.split("\t")
-                if len(linelist) == 0:
-                    continue
-                mge_id = linelist[0]
-                if mge_id in description_to_id:
-                    f.write(description_to_id[mge_id] + "\t" +
-                            "\t".join(linelist[1:]) + "\n")
-                else:
-                    f.write("\t".join(linelist) + "\n")
-        output = subprocess.run(
-            [f"sort-bed {mge_outputbed}.unsorted > {mge_outputbed}"],
-            check=True,
-            shell=True,
-        )
-        logger.success(f"Completed reformatting mge output to {mge_outputbed}")
-        return mge_outputbed
-
-
-def classify_mobileelementfinder(inputbed, is_elements_bed, maxdist):
+    write_bed(
+        sort_intervals(iter_mge_results(mge_outputcsv, description_to_id)),
+        mge_outputbed)
+    logger.success(f"Completed reformatting mge output to {mge_outputbed}")
+    return mge_outputbed
+
+
+def label_mobileelementfinder(regions, is_elements, maxdist, presorted=False):
+    """
+    Returns the sorted regions overlapping an IS element or flanked by two IS
+    elements of the same type. `is_elements` indexes the elements by contig.
+    """
+    classified = []
+    flanked_elements = {}
+    for element in regions:
+        contig_elements = is_elements.get(element.chrom)
+        if contig_elements is None:
+            continue
+
+        # Test if the element overlaps with an IS element
+        if contig_elements.overlapping(element.start, element.end):
+            classified.append(
+                Interval(element.chrom, element.start, element.end,
+                         [element.name + "|overlaps-IS"]))
+
+        # Find the nearest non-overlapping IS elements on both sides
+        left, left_distance = contig_elements.upstream(element.start)
+        right, right_distance = contig_elements.downstream(element.end)
+        if left is None or right is None:
+            continue  # Skip if no upstream or downstream IS element
+
+        # Skip if distances exceed maxdist
+        if abs(left_distance) > maxdist or abs(right_distance) > maxdist:
+            continue
+
+        # IS types are the column after the IS name
+        left_is_type = left.fields[1] if len(left.fields) > 1 else ""
+        right_is_type = right.fields[1] if len(right.fields) > 1 else ""
+        if left_is_type == right_is_type:
+            element_key = (element.chrom, element.start, element.end,
+                           element.name)
+            flanked_elements[element_key] = Interval(
+                element.chrom, element.start, element.end,
+                [element.name + f"|flanked-IS-{left_is_type}"])
+
+    if presorted:
+        # both lists follow the order of the sorted input
+        return merge_sorted(classified, flanked_elements.values())
+    classified.extend(flanked_elements.values())
+    return sort_intervals(classified)
+
+
+def classify_mobileelementfinder(inputbed,
+                                 is_elements_bed,
+                                 maxdist,
+                                 regions=None):
     bed = os.path.dirname(is_elements_bed)
     output_bed = os.path.join(bed, "input-mge_out-intersect.sorted.bed")
 
@@ -65,105 +102,13 @@ def classify_mobileelementfinder(inputbed, is_elements_bed, maxdist):
         f"Classifying elements for TN/IS association with max distance {maxdist} bp."
     )
 
-    # Ensure input BED files are sorted
-    inputbed_sorted = f"{inputbed}.sorted"
-    subprocess.run(
-        [f"sort-bed {inputbed} > {inputbed_sorted}"],
-        shell=True,
-        check=True,
-    )
-
-    # Test if the element overlaps with an IS element using bedmap
-    overlap_output = subprocess.run(
-        [f"bedmap --echo --skip-unmapped {inputbed_sorted} {is_elements_bed}"],
-        capture_output=True,
-        shell=True,
-        text=True,
-    )
-    if overlap_output.returncode != 0:
-        logger.error(
-            "Error in classifying elements overlapping IS elements! bedmap")
-        logger.error(overlap_output.stdout)
-        logger.error(overlap_output.stderr)
-        sys.exit(2)
-    else:
-        overlap_lines = overlap_output.stdout.strip().split('\n')
-        with open(f"{output_bed}.unsorted", "w") as f:
-            for line in overlap_lines:
-                fields = line.strip().split('\t')
-                if len(fields) >= 4:
-                    element_name = fields[3] + "|overlaps-IS"
-                    f.write('\t'.join(
-                        [fields[0], fields[1], fields[2], element_name]) +
-                            '\n')
-
-    # Use closest-features to find the nearest features on both sides
-    cmd_closest = f"closest-features --dist --delim '\t' --no-overlaps {inputbed_sorted} {is_elements_bed}"
-
-    # Run closest-features
-    output_closest = subprocess.run(
-        [cmd_closest],
-        capture_output=True,
-        shell=True,
-        text=True,
-    )
-
-    if output_closest.returncode != 0:
-        logger.error("Error in finding closest IS elements! closest-features")
-        logger.error(output_closest.stderr)
-        sys.exit(2)
-    else:
-        lines = output_closest.stdout.strip().split('\n')
-        flanked_elements = {}
-        for line in lines:
-            fields = line.strip().split('\t')
-            if len(fields) < 16:
-                continue  # Not enough fields, skip
-
-            # Input element fields
-            element_chrom = fields[0]
-            element_start = fields[1]
-            element_end = fields[2]
-            element_name = fields[3]
+    is_elements = index_by_chrom(read_bed(is_elements_bed))
+    if regions is None:
+        regions = read_bed(inputbed)
 
-            # Left (upstream) feature fields
-            left_fields = fields[4:9]  # chrom, start, end, name, type
-            left_distance = int(fields[9])
-
-            # Right (downstream) feature fields
-            right_fields = fields[10:15]  # chrom, start, end, name, type
-            right_distance = int(fields[15])
-
-            # Check if closest features were found
-            if left_fields[0] == 'NA' or right_fields[0] == 'NA':
-                continue  # Skip if no upstream or downstream IS element
-
-            # Skip if distances exceed maxdist
-            if abs(left_distance) > maxdist or abs(right_distance) > maxdist:
-                continue
-
-            # Extract IS types from the name fields
-            left_is_name = left_fields[3]
-            left_is_type = left_fields[4]
-            right_is_name = right_fields[3]
-            right_is_type = right_fields[4]
-
-            if left_is_type == right_is_type:
-                element_key = (element_chrom, element_start, element_end,
-                               element_name)
-                element_name_flanked = element_name + f"|flanked-IS-{left_is_type}"
-                flanked_elements[element_key] = element_name_flanked
-
-        with open(f"{output_bed}.unsorted", "a") as f:
-            for key, name in flanked_elements.items():
-                f.write('\t'.join([key[0], key[1], key[2], name]) + '\n')
-
-    # Sort the output bed file
-    subprocess.run(
-        [f"sort-bed {output_bed}.unsorted > {output_bed}"],
-        check=True,
-        shell=True,
-    )
+    write_bed(
+        label_mobileelementfinder(regions, is_elements, maxdist,
+                                  is_sorted_bed(inputbed)), output_bed)
     logger.success("Completed classifying elements for TN/IS association")
     return output_bed
 
@@ -240,13 +185,7 @@ def main():
         type=os.path.abspath,
         required=True,
     )
-    parser.add_argument(
-        "--fasta",
-        "-f",
-        help="[REQUIRED] Path to the input fasta file",
-        type=os.path.abspath,
-        required=True,
-    )
+    add_contig_arguments(parser)
     parser.add_argument(
         "--maxdist",
         "-m",
@@ -264,8 +203,11 @@ def main():
         default="./maybemobile_out/",
         required=False,
     )
+    add_bed_format_argument(parser)
     args = parser.parse_args()
-    description_to_id = read_fa(args.fasta)
+    use_binary_beds(args.binary_bed)
+    description_to_id = get_description_to_id(
+        load_contigs(args.index, args.fasta))
     # print(description_to_id)
     # print(args.input)
     bedmgeout = bedformat_mobileelementfinder(args.input, args.output,
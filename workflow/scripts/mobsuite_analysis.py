@@ -2,62 +2,135 @@
 
 import sys
 import os
-import subprocess
+import csv
+import itertools
 from loguru import logger
-from Bio import SeqIO
 import argparse
 
+from fasta_index import add_contig_arguments, load_contigs
+from intervals import (Interval, add_bed_format_argument, is_sorted_bed,
+                       read_bed, sort_intervals, use_binary_beds, write_bed)
 
-def classify_mobrecon(input_fasta, input_bed, mobrecondir, outputdir):
-    if not os.path.exists(os.path.join(outputdir)):
-        os.mkdir(os.path.join(outputdir))
+
+def read_report(report, columns):
+    """
+    Reads a mob-suite report into a list of rows holding the requested
+    columns. `columns` maps each column name to its position, used if the
+    report has no header line.
+    """
+    rows = []
+    with open(report, "r", newline="") as f:
+        reader = csv.reader(f, delimiter="\t")
+        header = next(reader, [])
+        if all(column in header for column in columns):
+            positions = [header.index(column) for column in columns]
+        else:
+            positions = list(columns.values())
+            reader = itertools.chain([header], reader)
+        for fields in reader:
+            if not fields or fields[0].startswith("#"):
+                continue
+            if len(fields) <= max(positions):
+                logger.error(f"Invalid line in {report}: {fields}")
+                sys.exit(2)
+            rows.append([fields[i] for i in positions])
+    return rows
+
+
+def read_contig_report(contigreport):
+    """
+    Returns the plasmid cluster of every contig mob_recon placed on a plasmid.
+    """
+    contig_to_plasmid = {}
+    rows = read_report(contigreport, {
+        "molecule_type": 1,
+        "primary_cluster_id": 2,
+        "contig_id": 4,
+    })
+    for molecule_type, plasmidid, contig_id in rows:
+        if molecule_type == "plasmid":
+            contig_to_plasmid[contig_id] = plasmidid
+    return contig_to_plasmid
+
+
+def read_mobtyper(mobtyper):
+    """
+    Returns the predicted mobility of every plasmid cluster.
+    """
+    plasmid_mobility = {}
+    rows = read_report(mobtyper, {"sample_id": 0, "predicted_mobility": 13})
+    for sample_id, mobility in rows:
+        # sample ids are written as <sample>:<plasmid cluster>
+        plasmid_mobility[sample_id.rsplit(":", 1)[-1]] = mobility
+    return plasmid_mobility
+
+
+def get_contig_plasmids(contigs, mobrecondir):
+    """
+    Returns the plasmid cluster and its predicted mobility of every contig
+    mob_recon placed on a plasmid, keyed by contig identifier.
+    """
     contigreport = os.path.join(mobrecondir, "contig_report.txt")
     mobtyper = os.path.join(mobrecondir, "mobtyper_results.txt")
-    output_bed = os.path.join(
-        outputdir,
-        "input-mobrecon_out-intersect.sorted.bed",
-    )
-    with open(f"{output_bed}", "w") as f:
-        pass
     if not os.path.exists(mobtyper):
         logger.info(
             "No plasmids identified by mob_recon from the provided assembly sequence"
         )
+        return {}
+
+    contig_to_plasmid = read_contig_report(contigreport)
+    plasmid_mobility = read_mobtyper(mobtyper)
+
+    # contig_report lists contigs by their fasta header or identifier
+    contig_plasmids = {}
+    for contig in contigs:
+        plasmidid = contig_to_plasmid.get(contig.description,
+                                          contig_to_plasmid.get(contig.id))
+        if plasmidid:
+            contig_plasmids[contig.id] = (plasmidid,
+                                          plasmid_mobility.get(plasmidid, ""))
+    return contig_plasmids
+
+
+def label_mobrecon(regions, contig_plasmids, presorted=False):
+    """
+    Returns the sorted regions on plasmid contigs, labelled with the plasmid
+    cluster and its mobility.
+    """
+    labelled = []
+    for element in regions:
+        plasmid = contig_plasmids.get(element.chrom)
+        if plasmid is None:
+            continue
+        plasmidid, mobility = plasmid
+        labelled.append(
+            Interval(
+                element.chrom, element.start, element.end,
+                element.fields + [f"plasmid-contig:{plasmidid}|{mobility}"]))
+    return sort_intervals(labelled, presorted)
+
+
+def classify_mobrecon(contigs,
+                      input_bed,
+                      mobrecondir,
+                      outputdir,
+                      regions=None):
+    if not os.path.exists(os.path.join(outputdir)):
+        os.mkdir(os.path.join(outputdir))
+    output_bed = os.path.join(
+        outputdir,
+        "input-mobrecon_out-intersect.sorted.bed",
+    )
+    contig_plasmids = get_contig_plasmids(contigs, mobrecondir)
+    if not contig_plasmids:
+        write_bed([], output_bed)
         return output_bed
-    else:
-        for contig in SeqIO.parse(input_fasta, "fasta"):
-            # print(contig.description)
-            plasmidid = (subprocess.run(
-                [
-                    f"grep \"{contig.description}\" {contigreport} \
-                    | awk -F'\\t' '$2 == \"plasmid\" {{print}}'\
-                    | cut -f3"
-                ],
-                capture_output=True,
-                shell=True,
-            ).stdout.decode().strip())
-            # print(plasmidid)
-            if plasmidid:
-                output = subprocess.run(
-                    [
-                        f'grep "{contig.id}" {input_bed} \
-                        | sed "s/$/\\tplasmid-contig:{plasmidid}|"$(grep {plasmidid} {mobtyper} | cut -f14)"/"'
-                    ],
-                    capture_output=True,
-                    shell=True,
-                )
-                # print(output)
-                if output.returncode != 0:
-                    logger.error(
-                        f"Error in classifying mobrecon's results! grep {contig.id} & {plasmidid}"
-                    )
-                    logger.error(output)
-                    logger.error(output.stdout.decode())
-                    logger.error(output.stderr.decode())
-                    sys.exit(2)
-                else:
-                    with open(f"{output_bed}", "a") as f:
-                        f.write(str(output.stdout.decode()))
+
+    if regions is None:
+        regions = read_bed(input_bed)
+    write_bed(
+        label_mobrecon(regions, contig_plasmids, is_sorted_bed(input_bed)),
+        output_bed)
     logger.success("Completed classifying mobrecon's output")
     return output_bed
 
@@ -71,13 +144,7 @@ def main():
         type=os.path.abspath,
         required=True,
     )
-    parser.add_argument(
-        "--fasta",
-        "-f",
-        help="[REQUIRED] Path to fasta file being analyzed",
-        type=os.path.abspath,
-        required=True,
-    )
+    add_contig_arguments(parser)
     parser.add_argument(
         "--bed",
         "-b",
@@ -102,8 +169,11 @@ def main():
         default=len(os.sched_getaffinity(0)),
         required=False,
     )
+    add_bed_format_argument(parser)
     args = parser.parse_args()
-    mobrecon_outbed = classify_mobrecon(args.fasta, args.bed, args.input,
+    use_binary_beds(args.binary_bed)
+    contigs = load_contigs(args.index, args.fasta)
+    mobrecon_outbed = classify_mobrecon(contigs, args.bed, args.input,
                                         args.output)
 
 
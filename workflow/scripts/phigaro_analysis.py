@@ -1,123 +1,114 @@
 #!/usr/bin/env python
 
 import argparse
+import csv
 import os
-import subprocess
 import sys
 from loguru import logger
-import pandas as pd
+
+from intervals import (Interval, add_bed_format_argument, index_by_chrom,
+                       is_sorted_bed, read_bed, sort_intervals,
+                       use_binary_beds, write_bed)
 
 
 def read_tsv(phigaro_tsv):
     """
-    Reads a Phigaro TSV file and returns a DataFrame for further processing.
+    Streams the prophages of a Phigaro TSV file as BED intervals carrying
+    their id and taxonomy.
     """
+    columns = ["scaffold", "begin", "end", "id", "taxonomy"]
     try:
-        prophage_data = pd.read_csv(phigaro_tsv, sep='\t')
+        with open(phigaro_tsv, "r", newline="") as f:
+            reader = csv.DictReader(f, delimiter="\t")
+            missing = [
+                column for column in columns
+                if column not in (reader.fieldnames or [])
+            ]
+            if missing:
+                raise ValueError(f"missing columns {missing}")
+            for row in reader:
+                yield Interval(row["scaffold"], int(row["begin"]),
+                               int(row["end"]), [row["id"], row["taxonomy"]])
         logger.debug("Successfully read Phigaro TSV file.")
-        return prophage_data
-    except Exception as e:
+    except (OSError, ValueError) as e:
         logger.error(f"Error reading Phigaro TSV file: {e}")
         sys.exit(1)
 
 
-def format_phigaro_output(prophage_data, analysis_outputdir):
+def format_phigaro_output(prophages, analysis_outputdir):
     """
     Formats the Phigaro TSV data into a BED-like file.
     """
     phigaro_bed = os.path.join(analysis_outputdir, "phigaro_out.bed")
-    with open(phigaro_bed, "w") as bedfile:
-        for _, row in prophage_data.iterrows():
-            bedfile.write(
-                f"{row['scaffold']}\t{row['begin']}\t{row['end']}\t{row['id']}\t{row['taxonomy']}\n"
-            )
+    # read_tsv exits on a malformed TSV while the BED is being written, so
+    # replace the BED only once every prophage has been read
+    tmp = f"{phigaro_bed}.tmp"
+    try:
+        write_bed(prophages, tmp)
+        os.replace(tmp, phigaro_bed)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
     logger.success(f"Phigaro TSV formatted to BED at {phigaro_bed}")
     return phigaro_bed
 
 
-def classify_phigaro(inputbed, phigaro_bed, maxdist):
+def classify_region(region, contig_prophages, maxdist):
+    """
+    Returns the best label of a region (inside, then near a prophage) and
+    its distance in bp to the closest prophage, or (None, None).
+    """
+    if contig_prophages.map_fraction(region.start,
+                                     region.end,
+                                     fraction_ref=1.0):
+        return "inside-prophage", 0
+    if not contig_prophages.window(region.start, region.end, maxdist):
+        return None, None
+    _, distance = contig_prophages.closest(region.start, region.end)
+    return "near-prophage", abs(distance)
+
+
+def label_phigaro(regions, prophages, maxdist, presorted=False):
+    """
+    Returns the sorted regions inside or near a prophage, labelled by their
+    position and their distance to the closest prophage, like
+    `name|near-prophage|1240`. `prophages` indexes the prophages by contig.
+    """
+    classified_elements = {}
+    for region in regions:
+        element_key = (region.chrom, region.start, region.end)
+        contig_prophages = prophages.get(region.chrom)
+        if contig_prophages is None or element_key in classified_elements:
+            continue
+        label, distance = classify_region(region, contig_prophages, maxdist)
+        if label is None:
+            continue
+        logger.debug(f"{region.chrom}:{region.start}-{region.end} is "
+                     f"{label} at {distance} bp")
+        # Append the label and the distance to the name field
+        fields = list(region.fields)
+        if fields:
+            fields[0] += f"|{label}|{distance}"
+        else:
+            fields.append(f"{label}|{distance}")
+        classified_elements[element_key] = Interval(region.chrom, region.start,
+                                                    region.end, fields)
+
+    # regions were classified in input order
+    return sort_intervals(classified_elements.values(), presorted)
+
+
+def classify_phigaro(inputbed, phigaro_bed, maxdist, regions=None):
     bed = os.path.dirname(phigaro_bed)
-    output_bed_unsorted = os.path.join(
-        bed, "input-phigaro_out-intersect.bed.unsorted")
     output_bed = os.path.join(bed, "input-phigaro_out-intersect.sorted.bed")
 
-    classified_elements = set()
-    custom_delim = '\x1f'  # Using ASCII Unit Separator as a custom delimiter
-
-    # First, find elements inside prophages
-    cmd_inside = f"bedmap --echo --echo-map-id-uniq --fraction-ref 1.0 --delim '{custom_delim}' {inputbed} {phigaro_bed}"
-    output = subprocess.run(cmd_inside, shell=True, capture_output=True)
-    if output.returncode != 0:
-        logger.error(
-            "Error in classifying elements inside prophages using bedmap!")
-        logger.error(output.stderr.decode())
-        sys.exit(2)
-
-    # Process the output for elements inside prophages
-    with open(output_bed_unsorted, "w") as f:
-        for line in output.stdout.decode().splitlines():
-            if not line.strip():
-                continue
-            if line.endswith(custom_delim):
-                # No overlap
-                continue
-            else:
-                # Overlap exists
-                parts = line.strip().split(custom_delim)
-                bed_entry = parts[0]
-                map_ids = parts[1] if len(parts) > 1 else ''
-                fields = bed_entry.strip().split('\t')
-                element_key = '\t'.join(fields[:3])  # chrom, start, end
-                if element_key not in classified_elements:
-                    classified_elements.add(element_key)
-                    # Append "|inside-prophage" to the name field
-                    if len(fields) >= 4:
-                        fields[3] += "|inside-prophage"
-                    else:
-                        fields.append("inside-prophage")
-                    f.write('\t'.join(fields) + '\n')
-
-    # Now find elements within maxdist distance from prophages
-    cmd_within = f"bedmap --echo --echo-map-id --range {maxdist} --delim '{custom_delim}' {inputbed} {phigaro_bed}"
-    output = subprocess.run(cmd_within, shell=True, capture_output=True)
-    if output.returncode != 0:
-        logger.error(
-            "Error in identifying elements near prophages using bedmap!")
-        logger.error(output.stderr.decode())
-        sys.exit(2)
-
-    # Process the output for elements near prophages
-    with open(output_bed_unsorted, "a") as f:
-        for line in output.stdout.decode().splitlines():
-            if not line.strip():
-                continue
-            if line.endswith(custom_delim):
-                # No overlap
-                continue
-            else:
-                # Overlap exists
-                parts = line.strip().split(custom_delim)
-                bed_entry = parts[0]
-                map_ids = parts[1] if len(parts) > 1 else ''
-                fields = bed_entry.strip().split('\t')
-                element_key = '\t'.join(fields[:3])
-                if element_key not in classified_elements:
-                    classified_elements.add(element_key)
-                    # Append "|near-prophage" to the name field
-                    if len(fields) >= 4:
-                        fields[3] += "|near-prophage"
-                    else:
-                        fields.append("near-prophage")
-                    f.write('\t'.join(fields) + '\n')
-
-    # Sort the output BED file
-    cmd_sort = f"sort-bed {output_bed_unsorted} > {output_bed}"
-    output = subprocess.run(cmd_sort, shell=True, capture_output=True)
-    if output.returncode != 0:
-        logger.error("Error in sorting the classified BED file!")
-        logger.error(output.stderr.decode())
-        sys.exit(2)
+    prophages = index_by_chrom(read_bed(phigaro_bed))
+    if regions is None:
+        regions = read_bed(inputbed)
 
+    write_bed(
+        label_phigaro(regions, prophages, maxdist, is_sorted_bed(inputbed)),
+        output_bed)
     logger.success("Completed classifying elements relative to Phigaro output")
     return output_bed
 
@@ -145,12 +136,13 @@ def main():
                         help="Max distance to consider near a prophage",
                         type=int,
                         default=10000)
+    add_bed_format_argument(parser)
     args = parser.parse_args()
+    use_binary_beds(args.binary_bed)
 
     os.makedirs(args.output, exist_ok=True)
 
-    prophage_data = read_tsv(args.input)
-    prophage_bed = format_phigaro_output(prophage_data, args.output)
+    prophage_bed = format_phigaro_output(read_tsv(args.input), args.output)
     classify_phigaro(args.bed, prophage_bed, args.maxdist)
 
 
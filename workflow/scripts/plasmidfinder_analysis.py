@@ -1,51 +1,51 @@
 #!/usr/bin/env python
 import argparse
-import subprocess
+import json
 import os
 import sys
 from loguru import logger
-from Bio import SeqIO
 
+from fasta_index import (add_contig_arguments, get_description_to_id,
+                         load_contigs)
+from intervals import (Interval, add_bed_format_argument, iter_bed_lines,
+                       sort_intervals, use_binary_beds, write_bed)
 
-def check_input(input_fasta, input_bed):
-    fasta_sequences = SeqIO.parse(open(input_fasta), "fasta")
+
+def check_input(contigs, input_bed):
     # define a dictionary of chromosome keys and values
-    description_to_id = {}
-    for i in fasta_sequences:
-        description_to_id[i.description] = i.id
-    logger.debug(f"Fasta header to identifier is: {description_to_id}")
+    description_to_id = get_description_to_id(contigs)
     output_bed = os.path.join(
         os.path.dirname(input_bed),
         os.path.basename(input_bed) + "-chromosomeid",
     )
 
     exit = False
-    # open the input BED file for reading
-    with open(input_bed, "r") as input_file:
-        # open the output BED file for writing
-        with open(output_bed, "w") as output_file:
-            # loop through each line in the input BED file
-            for line in input_file:
-                # split the line into columns
-                fields = line.strip().split("\t")
-                if len(fields) != 4:
-                    print(fields)
-                    logger.error(
-                        f"Number of columns is {len(fields)}! This is not 4! Please make it 4 columns!"
-                    )
-                    exit = True
-
-                # check if the chromosome in the line matches a key in the dictionary
-                if fields[0] in description_to_id:
-                    exit = True
-                    logger.error(
-                        f"{fields[0]} found in bed file! Please use {description_to_id[fields[0]]} instead! Reformatted bedfile outputted here {output_bed}. Please rerun mamo with that bed file instead!"
-                    )
-                    # if there is a match, replace the chromosome value with the dictionary value
-                    fields[0] = description_to_id[fields[0]]
-
-                # write the updated line to the output BED file
-                output_file.write("\t".join(fields) + "\n")
+    # open the output BED file for writing
+    with open(output_bed, "w") as output_file:
+        # loop through each line in the input BED file, text or binary
+        for line in iter_bed_lines(input_bed):
+            if line.startswith("#"):
+                continue
+            # split the line into columns
+            fields = line.strip().split("\t")
+            if len(fields) != 4:
+                print(fields)
+                logger.error(
+                    f"Number of columns is {len(fields)}! This is not 4! Please make it 4 columns!"
+                )
+                exit = True
+
+            # check if the chromosome in the line matches a key in the dictionary
+            if fields[0] in description_to_id:
+                exit = True
+                logger.error(
+                    f"{fields[0]} found in bed file! Please use {description_to_id[fields[0]]} instead! Reformatted bedfile outputted here {output_bed}. Please rerun mamo with that bed file instead!"
+                )
+                # if there is a match, replace the chromosome value with the dictionary value
+                fields[0] = description_to_id[fields[0]]
+
+            # write the updated line to the output BED file
+            output_file.write("\t".join(fields) + "\n")
     if exit:
         sys.exit(2)
     else:
@@ -53,128 +53,52 @@ def check_input(input_fasta, input_bed):
     return description_to_id
 
 
+def iter_plasmidfinder_hits(results):
+    """
+    Yields every hit of PlasmidFinder's nested results, whatever the
+    database and subgroup it was found in. Databases without hits hold the
+    string "No hit found" instead of a dictionary.
+    """
+    if not isinstance(results, dict):
+        return
+    if "positions_in_contig" in results:
+        yield results
+        return
+    for value in results.values():
+        yield from iter_plasmidfinder_hits(value)
+
+
+def read_plasmidfinder_json(pfinderout, description_to_id):
+    replicons = []
+    # the workflow leaves an empty data.json for empty assemblies
+    if os.path.getsize(pfinderout) == 0:
+        return replicons
+    with open(pfinderout, "r") as f:
+        try:
+            data = json.load(f)
+        except json.JSONDecodeError as e:
+            logger.error(f"Error in parsing plasmidfinder output: {e}")
+            sys.exit(2)
+    results = data.get("plasmidfinder", {}).get("results", {})
+    for hit in iter_plasmidfinder_hits(results):
+        pfinder_id = hit["contig_name"]
+        start, end = hit["positions_in_contig"].split("..")
+        replicons.append(
+            Interval(description_to_id.get(pfinder_id, pfinder_id), int(start),
+                     int(end),
+                     [hit["plasmid"], hit.get("note", "")]))
+    return replicons
+
+
 def bedformat_plasmidfinder(pfinderout, output, description_to_id):
     pfinder_outputbed = os.path.dirname(output)
     pfinder_outputbed = os.path.join(pfinder_outputbed,
                                      "plasmidfinder_out.sorted.bed")
-    output = subprocess.run(
-        [
-            f"csvtk cut -t -f Contig,'Position in contig',Plasmid,Note {pfinderout} \
-            | sed 1d"
-        ],
-        capture_output=True,
-        shell=True,
-    )
-    if output.returncode != 0:
-        logger.error("Error in formatting plasmidfinder output as bedfile!")
-        logger.error(output.stdout.decode())
-        logger.error(output.stderr.decode())
-        sys.exit(2)
-    else:
-        with open(f"{pfinder_outputbed}.unsorted", "w") as f:
-            for lines in output.stdout.decode().split("\n"):
-                linelist = lines.split("\t")
-                if len(linelist) <= 1:
-                    continue
-                pfinder_id = linelist[0]
-                pfinder_coords = linelist[1].split("..")
-                if pfinder_id in description_to_id:
-                    f.write(description_to_id[pfinder_id] + "\t" +
-                            "\t".join(pfinder_coords) + "\t" +
-                            "\t".join(linelist[2:]) + "\n")
-                else:
-                    f.write(pfinder_id + "\t" + "\t".join(pfinder_coords) +
-                            "\t" + "\t".join(linelist[2:]) + "\n")
-        output = subprocess.run(
-            [f"sort-bed {pfinder_outputbed}.unsorted > {pfinder_outputbed}"],
-            check=True,
-            shell=True,
-        )
-        logger.success(
-            f"Completed reformatting plasmidfinder output to {pfinder_outputbed}"
-        )
-        return pfinder_outputbed
-
-
-def classify_plasmidfinder(inputfasta, inputbed, bedpfinder):
-    max_plasmidlen = 200000
-    maxdist = 20000
-
-    bed = os.path.dirname(bedpfinder)
-    output_bed = os.path.join(bed, "input-pfinder_out-intersect.sorted.bed")
-    with open(f"{output_bed}", "w") as f:
-        pass
-
-    for contig in SeqIO.parse(inputfasta, "fasta"):
-        output = subprocess.run(["grep", contig.id, bedpfinder],
-                                stdout=subprocess.PIPE).stdout.decode("utf-8")
-        if not output:
-            logger.info(
-                f"No plasmid elements found on {contig.id}. Continuing")
-            continue
-        output = subprocess.run(["grep", contig.id, inputbed],
-                                stdout=subprocess.PIPE).stdout.decode("utf-8")
-        if not output:
-            logger.info(f"No tested elements are on {contig.id}. Continuing")
-            continue
-        contig_len = len(contig)
-        if contig_len > max_plasmidlen:
-            logger.info(
-                f"{contig.id} is {contig_len:,} bp which is greater than max \
-plasmid len: {max_plasmidlen:,} bp.")
-            logger.info(f"treating {contig.id} as a chromosome.")
-            logger.info(
-                f"searching for input elements within {maxdist} of plasmid elements"
-            )
-            output = subprocess.run(
-                [
-                    f"closest-features --chrom {contig.id} --dist --closest {inputbed} {bedpfinder} \
-                    | grep -v '|NA|NA$' \
-                    | awk -F'\\t' '{{split($7, a, \"|\");if(sqrt(a[2]^2) < {maxdist}){{print $0}}}}'"
-                ],
-                capture_output=True,
-                shell=True,
-            )
-            if output.returncode != 0:
-                logger.error(
-                    f"Error in classifying PlasmidFinder's results! closest-features {contig.id}"
-                )
-                logger.error(output.stdout.decode())
-                logger.error(output.stderr.decode())
-                sys.exit(2)
-            else:
-                with open(f"{output_bed}", "w") as f:
-                    f.write(str(output.stdout.decode()))
-                # logger.debug(output.stderr.decode())
-        else:
-            logger.info(f"{contig.id} is {contig_len:,} bp")
-            logger.info(
-                f"treating {contig.id} as a plasmid. classifying all input elements on this contig as maybe mobile"
-            )
-            output = subprocess.run(
-                [
-                    # f"grep {contig.id} {bedpfinder} | cut -f4"
-                    f'grep {contig.id} {inputbed} | sed "s~$~\\tplasmid-contig|$(printf \'%q\' "$(grep {contig.id} {bedpfinder} | cut -f4)")~"'
-                    # | sed "s/$/\\tplasmid-contig|$(grep {contig.id} {bedpfinder} | cut -f4 | sed \'s/$/-/\')/"'
-                    # | sed "s/$/\tplasmid-contig|$(grep {contig.id} {bedpfinder} | cut -f4 | tr "\\n" "-" | sed \'s/-$/{chr(92)}n/\')/"'
-                ],
-                capture_output=True,
-                shell=True,
-            )
-            logger.debug(output)
-            if output.returncode != 0:
-                logger.error(
-                    f"Error in classifying PlasmidFinder's results! grep {contig.id}"
-                )
-                logger.error(output)
-                logger.error(output.stdout.decode())
-                logger.error(output.stderr.decode())
-                sys.exit(2)
-            else:
-                with open(f"{output_bed}", "a") as f:
-                    f.write(str(output.stdout.decode()))
-    logger.success("Completed classifying PlasmidFinder output")
-    return output_bed
+    replicons = read_plasmidfinder_json(pfinderout, description_to_id)
+    write_bed(sort_intervals(replicons), pfinder_outputbed)
+    logger.success(
+        f"Completed reformatting plasmidfinder output to {pfinder_outputbed}")
+    return pfinder_outputbed
 
 
 def main():
@@ -182,17 +106,11 @@ def main():
     parser.add_argument(
         "--input",
         "-i",
-        help="[REQUIRED] Path to plasmidfinder's output",
-        type=os.path.abspath,
-        required=True,
-    )
-    parser.add_argument(
-        "--fasta",
-        "-f",
-        help="[REQUIRED] Path to fasta file being analyzed",
+        help="[REQUIRED] Path to plasmidfinder's data.json output",
         type=os.path.abspath,
         required=True,
     )
+    add_contig_arguments(parser)
     parser.add_argument(
         "--bed",
         "-b",
@@ -209,9 +127,12 @@ def main():
         default="./maybemobile_out/",
         required=False,
     )
+    add_bed_format_argument(parser)
     args = parser.parse_args()
+    use_binary_beds(args.binary_bed)
 
-    description_to_id = check_input(args.fasta, args.bed)
+    contigs = load_contigs(args.index, args.fasta)
+    description_to_id = check_input(contigs, args.bed)
     plasmidfinder_outbed = bedformat_plasmidfinder(args.input, args.output,
                                                    description_to_id)
 
@@ -0,0 +1,244 @@
+#!/usr/bin/env python
+
+import argparse
+import glob
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from loguru import logger
+
+from batch_lists import get_sample_name, read_batch_lists
+from intervals import add_bed_format_argument
+from postprocess_sample import postprocess_sample
+
+
+def read_batches(input_dir, batches=None):
+    """
+    Reads the assembly and BED lists of every batch in `input_dir` like
+    init.smk does: line N of `{batch}.txt` and `{batch}.beds` is sequence N.
+    """
+    manifests = {}
+    for txt in sorted(glob.glob(os.path.join(input_dir, "*.txt"))):
+        batch = os.path.basename(txt)[:-4]
+        if batches and batch not in batches:
+            continue
+        beds = os.path.join(input_dir, f"{batch}.beds")
+        if not os.path.exists(beds):
+            logger.error(f"No list of bed files {beds} for batch {batch}")
+            sys.exit(2)
+        try:
+            manifests[batch] = read_batch_lists(batch, txt, beds)
+        except ValueError as e:
+            logger.error(e)
+            sys.exit(2)
+    return manifests
+
+
+def sample_paths(intermediate_dir, output_dir, batch, seqnum, sample_path,
+                 bed_path):
+    """
+    The inputs and outputs of one sample, at the paths used by the rules.
+    """
+    sample = get_sample_name(sample_path)
+    batch_dir = os.path.join(intermediate_dir, batch)
+    sequence = f"sequence_{seqnum}"
+
+    def raw_dir(tool):
+        return os.path.join(batch_dir, tool, "raw", sequence)
+
+    def processed_dir(tool):
+        return os.path.join(batch_dir, tool, "processed", sequence, sample)
+
+    # the files each tool rule leaves behind once it finished
+    raw = {
+        "integronfinder":
+        os.path.join(raw_dir("IntegronFinder"),
+                     f"Results_Integron_Finder_{sample}", f"{sample}.summary"),
+        "plasmidfinder":
+        os.path.join(raw_dir("PlasmidFinder"), sample, "data.json"),
+        "mob_suite":
+        os.path.join(raw_dir("mob-suite"), sample, "contig_report.txt"),
+        "phigaro":
+        os.path.join(raw_dir("phigaro"), f"{sample}.phigaro.tsv"),
+        "mobileelementfinder":
+        os.path.join(raw_dir("mobileelementfinder"), sample,
+                     "mge_results.csv"),
+    }
+    # the raw input and processed output directory given to each classifier
+    tools = {
+        "integronfinder": (os.path.dirname(raw["integronfinder"]),
+                           processed_dir("IntegronFinder")),
+        "plasmidfinder":
+        (raw["plasmidfinder"], processed_dir("PlasmidFinder")),
+        "mob_suite": (os.path.dirname(raw["mob_suite"]),
+                      os.path.join(processed_dir("mob-suite"),
+                                   "mobrecon_out")),
+        "phigaro": (raw["phigaro"], processed_dir("phigaro")),
+        "mobileelementfinder":
+        (raw["mobileelementfinder"], processed_dir("mobileelementfinder")),
+    }
+    return dict(
+        name=f"{batch}/{sequence}-{sample}",
+        fasta=sample_path,
+        index=os.path.join(batch_dir, "fasta_index",
+                           f"{sequence}.contigs.tsv"),
+        bed=bed_path,
+        cleaned=os.path.join(batch_dir, "cleaned_beds",
+                             f"{sequence}.cleaned.bed"),
+        raw=raw,
+        tools=tools,
+        output=os.path.join(output_dir, batch,
+                            f"{sequence}-{sample}-callmemobile.tsv"),
+    )
+
+
+def is_up_to_date(paths):
+    if not os.path.exists(paths["output"]):
+        return False
+    output_time = os.path.getmtime(paths["output"])
+    inputs = [paths["bed"]] + list(paths["raw"].values())
+    return all(os.path.getmtime(path) <= output_time for path in inputs)
+
+
+def find_samples(manifests, intermediate_dir, output_dir, force=False):
+    """
+    Returns the samples whose raw tool outputs all exist, skipping those
+    whose aggregated table is already newer than its inputs.
+    """
+    ready = []
+    for batch, samples in manifests.items():
+        for seqnum, (sample_path, bed_path) in enumerate(samples, start=1):
+            paths = sample_paths(intermediate_dir, output_dir, batch, seqnum,
+                                 sample_path, bed_path)
+            missing = [
+                tool for tool, path in paths["raw"].items()
+                if not os.path.exists(path)
+            ]
+            if missing:
+                logger.debug(f"Skipping {paths['name']}, no results from "
+                             f"{', '.join(missing)}")
+                continue
+            if not force and is_up_to_date(paths):
+                logger.debug(f"Skipping {paths['name']}, already up to date")
+                continue
+            ready.append(paths)
+    return ready
+
+
+def process_sample(paths, params):
+    # tool errors exit the interpreter; keep the worker alive and report them
+    try:
+        index = paths["index"] if os.path.exists(paths["index"]) else None
+        return postprocess_sample(paths["bed"],
+                                  paths["cleaned"],
+                                  paths["tools"],
+                                  paths["output"],
+                                  index=index,
+                                  fasta=None if index else paths["fasta"],
+                                  **params)
+    except SystemExit:
+        return False
+    except Exception:
+        # report the sample and carry on with the others
+        logger.exception(f"Post-processing of {paths['name']} failed")
+        return False
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Classify and aggregate every sample whose tool results "
+        "are ready, in a pool of worker processes.")
+    parser.add_argument(
+        "--input_dir",
+        help="Directory with the {batch}.txt and {batch}.beds lists. "
+        "Default is ./input/",
+        type=os.path.abspath,
+        default="./input/",
+    )
+    parser.add_argument(
+        "--intermediate_dir",
+        help="Directory of the intermediate files. Default is "
+        "./intermediate/",
+        type=os.path.abspath,
+        default="./intermediate/",
+    )
+    parser.add_argument(
+        "--output_dir",
+        help="Directory of the aggregated tables. Default is ./output/",
+        type=os.path.abspath,
+        default="./output/",
+    )
+    parser.add_argument(
+        "--batch",
+        "-b",
+        help="Only process these batches. Default is every batch",
+        nargs="+",
+        required=False,
+    )
+    parser.add_argument(
+        "--threads",
+        "-t",
+        help="Number of worker processes. Default is 1.",
+        type=int,
+        default=1,
+        required=False,
+    )
+    parser.add_argument(
+        "--overlap",
+        "-bo",
+        help="Percentage of an Integron element to overlap with the input "
+        "bed in order to be classified as mobile",
+        type=float,
+        default=0.95)
+    parser.add_argument("--prophage_maxdist",
+                        help="Max distance to consider near a prophage",
+                        type=int,
+                        default=10000)
+    parser.add_argument(
+        "--mobileelement_maxdist",
+        help="Max. dist. to consider as mobile when sandwiched between two "
+        "MGEs of the same type",
+        type=int,
+        default=10000)
+    parser.add_argument(
+        "--force",
+        help="Process samples even if their output is up to date",
+        action="store_true",
+    )
+    add_bed_format_argument(parser)
+    args = parser.parse_args()
+
+    manifests = read_batches(args.input_dir, args.batch)
+    samples = find_samples(manifests, args.intermediate_dir, args.output_dir,
+                           args.force)
+    logger.info(f"Post-processing {len(samples)} samples from "
+                f"{len(manifests)} batches")
+    params = {
+        "overlap": args.overlap,
+        "prophage_maxdist": args.prophage_maxdist,
+        "mobileelement_maxdist": args.mobileelement_maxdist,
+        "binary_beds": args.binary_bed,
+    }
+    param_list = [params] * len(samples)
+    if args.threads > 1:
+        with ProcessPoolExecutor(max_workers=args.threads) as executor:
+            chunksize = max(1, len(samples) // (args.threads * 4))
+            results = list(
+                executor.map(process_sample,
+                             samples,
+                             param_list,
+                             chunksize=chunksize))
+    else:
+        results = list(map(process_sample, samples, param_list))
+
+    failed = [paths["name"] for paths, ok in zip(samples, results) if not ok]
+    if failed:
+        logger.error(f"Post-processing failed for {len(failed)} samples")
+        for name in failed:
+            logger.error(name)
+        sys.exit(1)
+    logger.success(f"Completed post-processing of {len(samples)} samples")
+
+
+if __name__ == "__main__":
+    main()
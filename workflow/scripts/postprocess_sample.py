@@ -0,0 +1,225 @@
+#!/usr/bin/env python
+
+import argparse
+import os
+import sys
+from loguru import logger
+
+import format_bed
+import plasmidfinder_analysis
+from callmemobile import TOOLS, aggregate
+from fasta_index import (add_contig_arguments, get_description_to_id,
+                         load_contigs)
+from integronfinder_analysis import (classify_integronfinder,
+                                     format_integronfinderout)
+from intervals import add_bed_format_argument, read_bed, use_binary_beds
+from mobileelementfinder_analysis import (bedformat_mobileelementfinder,
+                                          classify_mobileelementfinder)
+from mobsuite_analysis import classify_mobrecon
+from phigaro_analysis import classify_phigaro, format_phigaro_output, read_tsv
+
+TOOL_OPTIONS = [option for _, option in TOOLS]
+
+
+def touch(path):
+    open(path, "w").close()
+
+
+def postprocess_sample(input_bed,
+                       cleaned,
+                       tools,
+                       output,
+                       index=None,
+                       fasta=None,
+                       overlap=0.95,
+                       prophage_maxdist=10000,
+                       mobileelement_maxdist=10000,
+                       binary_beds=False):
+    """
+    Classifies the cleaned BED against the results of every tool and
+    aggregates the classifications, writing the same files as the separate
+    *_bed and aggregate_output rules. With an `input_bed`, it is first cleaned
+    to `cleaned` like reformat_bed does; without, `cleaned` must exist.
+    `tools` maps each tool option to its raw results and its processed output
+    directory. The contigs and cleaned regions are parsed once and shared by
+    every step. `binary_beds` writes the BED files in the format of
+    binary_bed.py.
+    """
+    use_binary_beds(binary_beds)
+    contigs = load_contigs(index, fasta)
+
+    if input_bed is not None:
+        logger.info(f"Cleaning {input_bed} to {cleaned}")
+        os.makedirs(os.path.dirname(cleaned), exist_ok=True)
+        description_to_id = format_bed.check_input(contigs, input_bed, cleaned)
+    else:
+        description_to_id = get_description_to_id(contigs)
+    regions = read_bed(cleaned)
+
+    integronfinder_dir, integronfinder_out = tools["integronfinder"]
+    os.makedirs(integronfinder_out, exist_ok=True)
+    integron_bed = format_integronfinderout(integronfinder_dir,
+                                            integronfinder_out)
+    integronfinder_bed = classify_integronfinder(cleaned, integron_bed,
+                                                 integronfinder_out, overlap,
+                                                 regions)
+
+    plasmidfinder_json, plasmidfinder_out = tools["plasmidfinder"]
+    os.makedirs(plasmidfinder_out, exist_ok=True)
+    plasmidfinder_analysis.check_input(contigs, cleaned)
+    # like the plasmidfinder_bed rule, report the replicons themselves
+    plasmidfinder_bed = plasmidfinder_analysis.bedformat_plasmidfinder(
+        plasmidfinder_json,
+        os.path.join(plasmidfinder_out, "plasmidfinder_out.sorted.bed"),
+        description_to_id,
+    )
+
+    mobrecon_dir, mobrecon_out = tools["mob_suite"]
+    os.makedirs(mobrecon_out, exist_ok=True)
+    mobrecon_bed = classify_mobrecon(contigs, cleaned, mobrecon_dir,
+                                     mobrecon_out, regions)
+
+    phigaro_tsv, phigaro_out = tools["phigaro"]
+    os.makedirs(phigaro_out, exist_ok=True)
+    if os.path.getsize(phigaro_tsv) > 0:
+        prophage_bed = format_phigaro_output(read_tsv(phigaro_tsv),
+                                             phigaro_out)
+        phigaro_bed = classify_phigaro(cleaned, prophage_bed, prophage_maxdist,
+                                       regions)
+    else:
+        phigaro_bed = os.path.join(phigaro_out,
+                                   "input-phigaro_out-intersect.sorted.bed")
+        touch(phigaro_bed)
+
+    mge_csv, mge_out = tools["mobileelementfinder"]
+    os.makedirs(mge_out, exist_ok=True)
+    is_elements_bed = bedformat_mobileelementfinder(mge_csv, mge_out,
+                                                    description_to_id)
+    mge_bed = classify_mobileelementfinder(cleaned, is_elements_bed,
+                                           mobileelement_maxdist, regions)
+
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    if not regions:
+        touch(output)
+        return True
+    tool_beds = {
+        "IntegronFinder": integronfinder_bed,
+        "PlasmidFinder": plasmidfinder_bed,
+        "mob_suite": mobrecon_bed,
+        "phigaro": phigaro_bed,
+        "mobileelementfinder": mge_bed,
+    }
+    return aggregate(cleaned, tool_beds, output, stream=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Clean, classify and aggregate the input regions of one "
+        "sample in a single process.")
+    parser.add_argument(
+        "--input",
+        "-i",
+        help="Path to input bed file, may be gzip compressed. Cleaned to "
+        "--cleaned when given",
+        type=os.path.abspath,
+        required=False,
+    )
+    add_contig_arguments(parser)
+    parser.add_argument(
+        "--cleaned",
+        help="[REQUIRED] Path to the reformatted bed file, written from "
+        "--input when given and read otherwise",
+        type=os.path.abspath,
+        required=True,
+    )
+    parser.add_argument(
+        "--integronfinder",
+        help="[REQUIRED] IntegronFinder's output directory and the directory "
+        "for its processed output",
+        nargs=2,
+        metavar=("RESULTS_DIR", "OUTDIR"),
+        required=True,
+    )
+    parser.add_argument(
+        "--plasmidfinder",
+        help="[REQUIRED] plasmidfinder's data.json output and the directory "
+        "for its processed output",
+        nargs=2,
+        metavar=("DATA_JSON", "OUTDIR"),
+        required=True,
+    )
+    parser.add_argument(
+        "--mob_suite",
+        help="[REQUIRED] mob_recon's output directory and the directory for "
+        "its processed output",
+        nargs=2,
+        metavar=("RESULTS_DIR", "OUTDIR"),
+        required=True,
+    )
+    parser.add_argument(
+        "--phigaro",
+        help="[REQUIRED] Phigaro's TSV output and the directory for its "
+        "processed output",
+        nargs=2,
+        metavar=("TSV", "OUTDIR"),
+        required=True,
+    )
+    parser.add_argument(
+        "--mobileelementfinder",
+        help="[REQUIRED] mobileelementfinder's output csv and the directory "
+        "for its processed output",
+        nargs=2,
+        metavar=("CSV", "OUTDIR"),
+        required=True,
+    )
+    parser.add_argument(
+        "--overlap",
+        "-bo",
+        help="Percentage of an Integron element to overlap with the input "
+        "bed in order to be classified as mobile",
+        type=float,
+        required=False,
+        default=0.95)
+    parser.add_argument("--prophage_maxdist",
+                        help="Max distance to consider near a prophage",
+                        type=int,
+                        default=10000)
+    parser.add_argument(
+        "--mobileelement_maxdist",
+        help="Max. dist. to consider as mobile when sandwiched between two "
+        "MGEs of the same type",
+        type=int,
+        default=10000)
+    parser.add_argument("--output",
+                        "-o",
+                        help="[REQUIRED] Path to the aggregated output file",
+                        type=os.path.abspath,
+                        required=True)
+    add_bed_format_argument(parser)
+    args = parser.parse_args()
+
+    tools = {
+        option: [os.path.abspath(path) for path in getattr(args, option)]
+        for option in TOOL_OPTIONS
+    }
+    if args.input is None and not os.path.exists(args.cleaned):
+        logger.error(f"Cleaned bed file {args.cleaned} does not exist, "
+                     "pass the bed file to clean with --input")
+        sys.exit(1)
+    if not postprocess_sample(args.input,
+                              args.cleaned,
+                              tools,
+                              args.output,
+                              index=args.index,
+                              fasta=args.fasta,
+                              overlap=args.overlap,
+                              prophage_maxdist=args.prophage_maxdist,
+                              mobileelement_maxdist=args.mobileelement_maxdist,
+                              binary_beds=args.binary_bed):
+        sys.exit(1)
+    logger.success(
+        f"Completed post-processing of {args.input or args.cleaned}")
+
+
+if __name__ == "__main__":
+    main()
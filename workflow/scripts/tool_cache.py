@@ -0,0 +1,306 @@
+#!/usr/bin/env python
+"""
+A cache of raw tool outputs shared by every batch and intermediate
+directory. Entries are keyed by the content of the assembly, the conda
+environment of the tool with the versions it resolved to, and the tool's
+parameters and databases, so an assembly that comes back in another batch
+restores its results instead of running the tool again.
+
+This script runs inside the conda environment of each tool, so it only uses
+the standard library and supports Python 3.7.
+"""
+
+import argparse
+import gzip
+import hashlib
+import os
+import shutil
+import subprocess
+import sys
+import time
+import uuid
+
+from fileio import is_gzipped
+
+# bump to invalidate every entry when the layout of the cache changes
+CACHE_VERSION = "2"
+
+# sample names in stored file names are replaced by this placeholder
+SAMPLE_PLACEHOLDER = "@SAMPLE@"
+
+
+def log(message):
+    print(f"[tool_cache] {message}", file=sys.stderr)
+
+
+def file_digest(path):
+    # compressed files are hashed by their content, so that an assembly has
+    # the same key plain and gzipped
+    digest = hashlib.sha256()
+    opener = gzip.open if is_gzipped(path) else open
+    with opener(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def resolved_packages():
+    """
+    The packages of the active conda environment with the versions and
+    builds that its unpinned YAML resolved to.
+    """
+    prefix = os.environ.get("CONDA_PREFIX")
+    if not prefix or not os.path.isdir(os.path.join(prefix, "conda-meta")):
+        return ""
+    return "\n".join(
+        sorted(name for name in os.listdir(os.path.join(prefix, "conda-meta"))
+               if name.endswith(".json")))
+
+
+def tool_version(version_command):
+    if not version_command:
+        return ""
+    result = subprocess.run(version_command,
+                            shell=True,
+                            stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT)
+    return result.stdout.decode(errors="replace")
+
+
+def cache_key(tool, fasta, env, params, version_command=""):
+    """
+    The key of a tool run: the assembly's content, the environment
+    installing the tool, the packages it resolved to, the version the tool
+    reports and its parameters, including the paths of its databases.
+    """
+    digest = hashlib.sha256()
+    for part in [
+            CACHE_VERSION, tool,
+            file_digest(fasta),
+            file_digest(env),
+            resolved_packages(),
+            tool_version(version_command)
+    ]:
+        digest.update(part.encode())
+        digest.update(b"\0")
+    for param in sorted(params):
+        digest.update(param.encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def entry_path(cache, key):
+    return os.path.join(cache, "objects", key[:2], key)
+
+
+def rename_tree(root, old, new):
+    """
+    Renames the files and directories below root named after sample `old`,
+    like Integron-Finder's {sample}.integrons, to sample `new`.
+    """
+    for dirpath, dirnames, filenames in os.walk(root, topdown=False):
+        for name in filenames + dirnames:
+            if name == old or name.startswith(f"{old}."):
+                os.rename(os.path.join(dirpath, name),
+                          os.path.join(dirpath, new + name[len(old):]))
+
+
+def copy_item(source, destination):
+    # copies get the current time as their modification time, so that
+    # restored outputs are not older than the inputs of the tool
+    if os.path.isdir(source):
+        shutil.copytree(source, destination, copy_function=shutil.copy)
+    else:
+        shutil.copy(source, destination)
+
+
+def remove_item(path):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    elif os.path.lexists(path):
+        os.remove(path)
+
+
+def restore(cache, key, outputs, sample):
+    """
+    Puts the stored outputs of a tool run in place. Returns whether the
+    cache held them.
+    """
+    entry = entry_path(cache, key)
+    if not os.path.exists(os.path.join(entry, "0")):
+        return False
+    try:
+        for i, output in enumerate(outputs):
+            stored = os.path.join(entry, str(i))
+            if not os.path.lexists(stored):
+                continue
+            remove_item(output)
+            parent = os.path.dirname(output)
+            if parent:
+                os.makedirs(parent, exist_ok=True)
+            copy_item(stored, output)
+            if os.path.isdir(output):
+                rename_tree(output, SAMPLE_PLACEHOLDER, sample)
+        # the modification time of an entry records its last use
+        os.utime(entry)
+    except OSError as e:
+        # an entry evicted while being restored is a miss
+        log(f"Could not restore {entry}: {e}")
+        for output in outputs:
+            remove_item(output)
+        return False
+    return True
+
+
+def entry_size(entry):
+    size = 0
+    for dirpath, _, filenames in os.walk(entry):
+        for name in filenames:
+            try:
+                size += os.lstat(os.path.join(dirpath, name)).st_size
+            except OSError:
+                pass
+    return size
+
+
+def evict(cache, max_bytes):
+    """
+    Removes the least recently used entries until the cache fits in
+    max_bytes.
+    """
+    objects = os.path.join(cache, "objects")
+    entries = []
+    for prefix in os.listdir(objects):
+        prefix_dir = os.path.join(objects, prefix)
+        for name in os.listdir(prefix_dir):
+            entry = os.path.join(prefix_dir, name)
+            # skip entries still being written by another job
+            if ".tmp-" in name:
+                continue
+            try:
+                last_used = os.stat(entry).st_mtime
+            except OSError:
+                continue
+            entries.append((last_used, entry_size(entry), entry))
+    total = sum(size for _, size, _ in entries)
+    entries.sort()
+    for _, size, entry in entries:
+        if total <= max_bytes:
+            break
+        shutil.rmtree(entry, ignore_errors=True)
+        total -= size
+        log(f"Evicted {entry}")
+
+
+def store(cache, key, outputs, sample, max_bytes):
+    """
+    Copies the outputs of a tool run into the cache, then evicts the least
+    recently used entries above the size cap.
+    """
+    entry = entry_path(cache, key)
+    if os.path.exists(entry):
+        os.utime(entry)
+        return
+    # build the entry aside and move it in place at once, so that parallel
+    # jobs never restore half an entry
+    tmp = f"{entry}.tmp-{uuid.uuid4().hex}"
+    os.makedirs(tmp)
+    try:
+        for i, output in enumerate(outputs):
+            if not os.path.lexists(output):
+                continue
+            stored = os.path.join(tmp, str(i))
+            copy_item(output, stored)
+            if os.path.isdir(stored):
+                rename_tree(stored, sample, SAMPLE_PLACEHOLDER)
+        os.rename(tmp, entry)
+    except OSError as e:
+        # another job stored the same run first, or the cache is full
+        log(f"Could not store {entry}: {e}")
+        shutil.rmtree(tmp, ignore_errors=True)
+        return
+    log(f"Stored {entry}")
+    if max_bytes > 0:
+        evict(cache, max_bytes)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Restore the raw outputs of a tool run from the cache, or "
+        "store them after the tool ran. Does nothing without --cache.")
+    parser.add_argument("command", choices=["restore", "store"])
+    parser.add_argument(
+        "--cache",
+        help="Directory of the cache. The cache is disabled if empty",
+        default="",
+    )
+    parser.add_argument(
+        "--max_size_gb",
+        help="Size cap of the cache in GB, 0 for no cap. Default is 0",
+        type=float,
+        default=0,
+    )
+    parser.add_argument("--tool", help="Name of the tool", required=True)
+    parser.add_argument("--fasta",
+                        help="Path to the assembly the tool ran on",
+                        required=True)
+    parser.add_argument("--env",
+                        help="Path to the conda environment of the tool",
+                        required=True)
+    parser.add_argument(
+        "--param",
+        help="A parameter of the tool, as name=value",
+        action="append",
+        default=[],
+    )
+    parser.add_argument(
+        "--version_command",
+        help="Command printing the version of the tool",
+        default="",
+    )
+    parser.add_argument("--sample",
+                        help="Name of the sample in the output file names",
+                        required=True)
+    parser.add_argument(
+        "--output",
+        help="Outputs of the tool to cache, files or directories. The first "
+        "one is required",
+        nargs="+",
+        required=True,
+    )
+    parser.add_argument(
+        "--hit_marker",
+        help="File created when restore finds the outputs in the cache, and "
+        "removed otherwise, so that the runtime of a restored job is not "
+        "taken for the runtime of the tool",
+        default="",
+    )
+    args = parser.parse_args()
+
+    if args.command == "restore" and args.hit_marker:
+        remove_item(args.hit_marker)
+    if not args.cache:
+        sys.exit(1 if args.command == "restore" else 0)
+    start = time.time()
+    key = cache_key(args.tool, args.fasta, args.env, args.param,
+                    args.version_command)
+    if args.command == "restore":
+        if not restore(args.cache, key, args.output, args.sample):
+            log(f"No cached {args.tool} results for {args.fasta}")
+            sys.exit(1)
+        if args.hit_marker:
+            os.makedirs(os.path.dirname(os.path.abspath(args.hit_marker)),
+                        exist_ok=True)
+            open(args.hit_marker, "w").close()
+        log(f"Restored cached {args.tool} results for {args.fasta} in "
+            f"{time.time() - start:.1f} s")
+    else:
+        if not os.path.lexists(args.output[0]):
+            log(f"{args.output[0]} is missing, not caching it")
+            sys.exit(0)
+        store(args.cache, key, args.output, args.sample,
+              int(args.max_size_gb * 1e9))
+
+
+if __name__ == "__main__":
+    main()